@@ -16,6 +16,7 @@ from app.extensions import cache, cors, redis_store, sql_db, migrate
 from app.settings import config, BaseConfig
 from app.sql_models import ChinaArea
 from app.import_data_to_mysql.script import import_all
+from app.utils.instrumentation import init_instrumentation
 
 
 sentry_sdk.init(
@@ -58,6 +59,7 @@ def create_app(config_name=None):
         if app.config["ELASTICSEARCH_URL"]
         else None
     )
+    init_instrumentation(app)
     return app
 
 
@@ -131,6 +133,7 @@ def register_logger(app):
     file_handler.setLevel(logging.INFO)
 
     if not app.debug:
+        app.logger.setLevel(logging.INFO)
         app.logger.addHandler(file_handler)
 
 
@@ -156,3 +159,53 @@ def register_commands(app):
         click.echo("Import movie data to database.")
         import_all()
         click.echo("Finished.")
+
+    @app.cli.command("similarity")
+    def rebuild_similarity():
+        """Rebuild the item similarity from the whole ratings table.
+        flask similarity
+        """
+        from app.tasks.recommender import get_item_similarity
+
+        get_item_similarity.delay()
+        click.echo("Sent item similarity rebuild task.")
+
+    @app.cli.command("scores")
+    def repair_movie_scores():
+        """Recompute the rating counters of every movie and the like counters of
+        every rating.
+        flask scores
+        """
+        from app.sql_models import MovieScore, Rating
+
+        changed = MovieScore.rebuild()
+        like_changed = Rating.rebuild_like_counts()
+        sql_db.session.commit()
+        click.echo(
+            "Repaired %d movie scores and %d like counts." % (changed, like_changed)
+        )
+
+    @app.cli.command("reindex")
+    def reindex():
+        """Rebuild the elasticsearch indexes of users, movies and celebrities.
+        flask reindex
+        """
+        from app.sql_models import Celebrity, Movie, User
+
+        for model in (User, Movie, Celebrity):
+            success, failed = model.reindex()
+            click.echo(
+                "Indexed %d %s, %d failed."
+                % (success, model.__tablename__, len(failed))
+            )
+
+    @app.cli.command("rank")
+    @click.option("--days", default=31, help="count of days to rebuild")
+    def rebuild_rank(days):
+        """Rebuild the leaderboard data in redis from the ratings table.
+        flask rank
+        """
+        from app.tasks.recommender import rebuild_rank_data
+
+        count = rebuild_rank_data(days)
+        click.echo("Rebuilt leaderboards of %d days from %d ratings." % (days, count))
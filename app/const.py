@@ -1,3 +1,6 @@
+from types import MappingProxyType
+
+
 class AccountOperations:
     CONFIRM = "confirm-email"
     RESET_PASSWORD = "reset-password"
@@ -60,3 +63,29 @@ ROLES_PERMISSIONS_MAP = {
         "DELETE_MOVIE",
     ],
 }
+
+# 权限位, 启动时由 ROLES_PERMISSIONS_MAP 生成, 校验权限时不查询数据库
+PERMISSION_BITS = MappingProxyType(
+    {
+        permission: 1 << index
+        for index, permission in enumerate(
+            sorted(
+                {
+                    permission
+                    for permissions in ROLES_PERMISSIONS_MAP.values()
+                    for permission in permissions
+                    if permission
+                }
+            )
+        )
+    }
+)
+
+ROLE_PERMISSION_MASKS = MappingProxyType(
+    {
+        role_name: sum(
+            PERMISSION_BITS[permission] for permission in set(permissions) if permission
+        )
+        for role_name, permissions in ROLES_PERMISSIONS_MAP.items()
+    }
+)
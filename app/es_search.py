@@ -1,31 +1,90 @@
+from itertools import chain
+
 from flask import current_app
+from elasticsearch.helpers import parallel_bulk, streaming_bulk
+
+from app.utils.local_search import get_local_index
+
 
+def _payload(model):
+    return {
+        field["key"]: getattr(model, field["key"]) for field in model.__searchable__
+    }
 
-def add_to_index(index, model):
+
+def _local_index(index):
     """
-    add to es and  modify a record through `id`
     :param index: es index
-    :param model: db.Model
-    :return: None
+    :return: LocalSearchIndex if elasticsearch is not configured, otherwise None
     """
-    if not current_app.elasticsearch:
-        return
-    payload = {}
-    for field in model.__searchable__:
-        payload[field["key"]] = getattr(model, field["key"])
-    current_app.elasticsearch.index(index=index, id=model.id, body=payload)
+    directory = current_app.config["LOCAL_SEARCH_DIR"]
+    if current_app.elasticsearch or not directory:
+        return None
+    return get_local_index(directory, index)
+
+
+def search_enabled():
+    """
+    :return: whether elasticsearch or the local index is configured
+    """
+    return bool(current_app.elasticsearch or current_app.config["LOCAL_SEARCH_DIR"])
+
+
+def _bulk_actions(index, models, removed_ids):
+    for model in models:
+        yield {"_index": index, "_id": model.id, "_source": _payload(model)}
+    for model_id in removed_ids:
+        yield {"_op_type": "delete", "_index": index, "_id": model_id}
 
 
-def remove_from_index(index, model):
+def bulk_index(index, models=(), removed_ids=(), chunk_size=None, thread_count=1):
     """
-    remove record from es through model
+    index and remove records through the `_bulk` api
     :param index: es index
-    :param model: db.Model
-    :return: None
+    :param models: iterable of db.Model to index, consumed lazily
+    :param removed_ids: ids of records to remove
+    :param chunk_size: count of actions of one request
+    :param thread_count: count of requests sent in parallel
+    :return: (count of succeeded actions, ids of failed actions)
     """
     if not current_app.elasticsearch:
-        return
-    current_app.elasticsearch.delete(index=index, id=model.id)
+        ops = chain(
+            (("index", model.id, _payload(model)) for model in models),
+            (("delete", model_id, None) for model_id in removed_ids),
+        )
+        local_index = _local_index(index)
+        if local_index is None:
+            return 0, []
+        compact_size = current_app.config["LOCAL_SEARCH_COMPACT_SIZE"]
+        return local_index.write(ops, compact_size), []
+    chunk_size = chunk_size or current_app.config["ELASTICSEARCH_BULK_CHUNK_SIZE"]
+    actions = _bulk_actions(index, models, removed_ids)
+    if thread_count > 1:
+        results = parallel_bulk(
+            current_app.elasticsearch,
+            actions,
+            thread_count=thread_count,
+            chunk_size=chunk_size,
+            raise_on_error=False,
+        )
+    else:
+        results = streaming_bulk(
+            current_app.elasticsearch,
+            actions,
+            chunk_size=chunk_size,
+            raise_on_error=False,
+        )
+    success, failed = 0, []
+    for ok, item in results:
+        if ok:
+            success += 1
+            continue
+        # the record was never indexed
+        if item.get("delete", {}).get("status") == 404:
+            continue
+        failed.append(int(list(item.values())[0]["_id"]))
+        current_app.logger.warning("elasticsearch bulk action failed: %s", item)
+    return success, failed
 
 
 def query_index(model, query, page, per_page):
@@ -38,7 +97,13 @@ def query_index(model, query, page, per_page):
     :return: [ids] of records, total
     """
     if not current_app.elasticsearch:
-        return [], 0
+        local_index = _local_index(model.__tablename__)
+        if local_index is None:
+            return [], 0
+        weights = {
+            field["key"]: field.get("weight", 1) for field in model.__searchable__
+        }
+        return local_index.search(query, weights, page, per_page)
     fields = []
     for field in model.__searchable__:
         fields.append(field["key"] + "^" + str(field.get("weight", 1)))
@@ -0,0 +1,77 @@
+"""
+follow feed: ratings are pushed to a capped timeline of every follower when
+written, ratings of users with too many followers are merged when read
+"""
+from flask import current_app
+from flask_sqlalchemy import Pagination
+
+from app.extensions import sql_db
+from app.sql_models import Rating, followers
+from app.tasks.feed import fill_timeline
+from app.utils.redis_utils import get_feed_celebrities, get_timeline, timeline_score
+
+
+def follow_feed_query(user):
+    s = user.followed.subquery()
+    return (
+        sql_db.session.query(Rating)
+        .join(s, Rating.user_id == s.c.id)
+        .order_by(Rating.created_at.desc())
+    )
+
+
+def get_follow_feed(user, page, per_page):
+    """
+    read one page of ratings of the users followed by `user`
+    :param user: User
+    :param page: current page
+    :param per_page: items count of one page
+    :return: Pagination of Rating
+    """
+    size = current_app.config["FEED_TIMELINE_SIZE"]
+    end = page * per_page
+    entries, total = [], None
+    if end <= size:
+        entries, total = get_timeline(
+            user.id, end, current_app.config["FEED_TIMELINE_EXPIRE"]
+        )
+    if total is None:
+        # pages beyond the cap, or a timeline not filled yet
+        pagination = follow_feed_query(user).paginate(page, per_page)
+        if end <= size:
+            fill_timeline.delay(user.id)
+            pagination.total = min(pagination.total, size)
+        return pagination
+
+    followed_ids = {
+        followed_id
+        for (followed_id,) in sql_db.session.query(followers.c.followed_id).filter(
+            followers.c.follower_id == user.id
+        )
+    }
+    # entries of unfollowed users may stay until the unfollow task runs
+    merged = {
+        rating_id: (timestamp, rating_id)
+        for rating_id, author_id, timestamp in entries
+        if author_id in followed_ids
+    }
+    celebrity_ids = followed_ids & get_feed_celebrities()
+    if celebrity_ids:
+        query = sql_db.session.query(Rating.id, Rating.created_at).filter(
+            Rating.user_id.in_(celebrity_ids)
+        )
+        for rating_id, created_at in query.order_by(Rating.created_at.desc()).limit(
+            end
+        ):
+            merged[rating_id] = (timeline_score(created_at), rating_id)
+        total += query.count()
+    # the feed is the newest `size` ratings, whether timelines are filled or not
+    total = min(total, size)
+
+    ids = [
+        rating_id
+        for _, rating_id in sorted(merged.values(), reverse=True)[end - per_page : end]
+    ]
+    ratings = {rating.id: rating for rating in Rating.query.filter(Rating.id.in_(ids))}
+    items = [ratings[rating_id] for rating_id in ids if rating_id in ratings]
+    return Pagination("", page, per_page, total, items)
@@ -1,25 +1,84 @@
-from app.tasks.recommender import get_item_similarity
-from app.sql_models import Rating, User
-from app.extensions import cache
-from app.utils.redis_utils import get_task_id_from_redis
+import time
+
+from flask import current_app
+
+from app.sql_models import Rating
+from app.extensions import sql_db
+from app.utils.item_similarity import rank_candidates
+from app.utils.redis_utils import get_item_neighbours, get_similarity_snapshot_version
+from app.utils.similarity_snapshot import SimilaritySnapshot, snapshot_path
+
+
+class _SnapshotHolder:
+    """
+    the snapshot mapped by this process, swapped when a new version is published
+    """
+
+    def __init__(self):
+        self.snapshot = None
+        self.checked_at = 0
+
+    def get(self):
+        now = time.monotonic()
+        if (
+            now - self.checked_at
+            < current_app.config["ITEM_CF_SNAPSHOT_CHECK_INTERVAL"]
+        ):
+            return self.snapshot
+        self.checked_at = now
+        version = get_similarity_snapshot_version()
+        if version is None:
+            return self.snapshot
+        if self.snapshot is None or self.snapshot.version != version:
+            try:
+                self.snapshot = SimilaritySnapshot(
+                    snapshot_path(current_app.config["ITEM_CF_SNAPSHOT_DIR"], version)
+                )
+            except FileNotFoundError:
+                # not shared with the celery worker, use the redis store
+                self.snapshot = None
+        return self.snapshot
+
+
+_snapshot_holder = _SnapshotHolder()
+
+
+def gather_item_neighbours(movie_ids, k):
+    """
+    :param movie_ids: ids of movies rated by the user
+    :param k: count of most similar movies gathered for every movie
+    :return: (index into `movie_ids` of every entry, neighbour ids, weights)
+    """
+    snapshot = _snapshot_holder.get()
+    if snapshot is not None:
+        return snapshot.gather(movie_ids, k)
+    rows = get_item_neighbours(movie_ids, k)
+    entries = [
+        (owner, j, wj)
+        for owner, movie_id in enumerate(movie_ids)
+        for j, wj in rows[movie_id]
+    ]
+    if not entries:
+        return [], [], []
+    return tuple(zip(*entries))
 
 
-@cache.cached(60, "recommend-movies-for-user", query_string=True)
 def item_cf_recommendation(user_id, k):
-    w = get_item_similarity.AsyncResult(get_task_id_from_redis("recomm-task")).get()
-    res = {}
-    if not w:
-        return
-    user = User.query.get(user_id)
-    if not user:
-        return
-    for rating_i in user.ratings.all():
-        if not w.get(str(rating_i.movie_id)):
-            continue
-        for j, wj in sorted(
-            w[str(rating_i.movie_id)].items(), key=lambda item: item[1], reverse=True
-        )[0:k]:
-            if user.ratings.filter_by(movie_id=j).first():
-                continue
-            res[j] = res.get(j, 0) + wj * rating_i.score
-    return list(res.keys())
+    """
+    :param user_id: User.id
+    :param k: count of most similar movies used for every rated movie
+    :return: (ids of recommended movies, scores) ranked by score desc
+    """
+    rated = (
+        sql_db.session.query(Rating.movie_id, Rating.score)
+        .filter(Rating.user_id == user_id)
+        .all()
+    )
+    if not rated:
+        return [], []
+    movie_ids = [movie_id for movie_id, _ in rated]
+    owner, neighbour_ids, weights = gather_item_neighbours(movie_ids, k)
+    ranked_ids, scores = rank_candidates(
+        owner, neighbour_ids, weights, [score or 0 for _, score in rated], movie_ids
+    )
+    return ranked_ids.tolist(), scores.tolist()
@@ -68,23 +68,103 @@ class BaseConfig(object):
     CELERY_TIMEZONE = "Asia/Shanghai"
     CELERY_TASK_RESULT_EXPIRES = 60 * 60
     CELERYD_CONCURRENCY = os.getenv("CELERYD_CONCURRENCY", 12)
-    CELERY_IMPORTS = ("app.tasks.email", "app.tasks.recommender")
+    CELERY_IMPORTS = (
+        "app.tasks.email",
+        "app.tasks.feed",
+        "app.tasks.recommender",
+        "app.tasks.search",
+    )
     CELERYBEAT_SCHEDULE = {
+        "update-item-similarity": {
+            "task": "app.tasks.recommender.update_item_similarity",
+            "schedule": 10,
+            "args": [],
+        },
+        # 全量重算, 同时修正增量更新中近似的 top-K 邻居
         "computer-item-similarity": {
             "task": "app.tasks.recommender.get_item_similarity",
-            "schedule": 10,
+            "schedule": 60 * 60,
+            "args": [],
+        },
+        # movie_scores 与 ratings.like_count 在写入时增量更新, 每天全量修正一次
+        "refresh-movie-scores": {
+            "task": "app.tasks.recommender.refresh_movie_scores",
+            "schedule": 60 * 60 * 24,
+            "args": [],
+        },
+        "refresh-user-recommendations": {
+            "task": "app.tasks.recommender.refresh_user_recommendations",
+            "schedule": 60,
             "args": [],
-        }
+        },
+        # 排行榜滚动窗口在评价时增量更新, 日期变化后由每天的 key 重建一次
+        "trim-rank-windows": {
+            "task": "app.tasks.recommender.trim_rank_windows",
+            "schedule": 60 * 60,
+            "args": [],
+        },
+        # 提交后写入 redis 的索引变更, 合并后批量同步到 elasticsearch
+        "sync-search-index": {
+            "task": "app.tasks.search.sync_search_index",
+            "schedule": 5,
+            "args": [],
+        },
     }
 
+    # item-cf 每部电影保存的最相似电影数量
+    ITEM_CF_TOP_K = int(os.getenv("ITEM_CF_TOP_K", 50))
+    # item-cf 快照目录, web 与 celery 需共享; 各 worker 检查新快照的间隔(秒)
+    ITEM_CF_SNAPSHOT_DIR = os.getenv(
+        "ITEM_CF_SNAPSHOT_DIR", os.path.join(basedir, "data", "item-cf")
+    )
+    ITEM_CF_SNAPSHOT_CHECK_INTERVAL = 10
+    # item-cf 全量重建和增量更新互斥的锁的超时时间(秒)
+    ITEM_CF_LOCK_TIMEOUT = 60 * 60
+    # 评价数少于 RECOMMEND_MIN_RATINGS 的用户使用热门推荐
+    RECOMMEND_MIN_RATINGS = 10
+    RECOMMEND_LIST_SIZE = 200
+    RECOMMEND_ACTIVE_DAYS = 30
+    # 排行榜页面的缓存时间, 缓存键包含排行榜版本, 有新评价时即失效
+    LEADERBOARD_CACHE_TIMEOUT = 60 * 10
+
+    # 关注动态: 评价写入时推送到每个粉丝的时间线, 时间线最多保存的评价数
+    FEED_TIMELINE_SIZE = 800
+    # 时间线未被读取时的保存时间, 过期后在读取时从 mysql 重新填充
+    FEED_TIMELINE_EXPIRE = 60 * 60 * 24 * 7
+    # 粉丝数超过该值的用户不推送, 读取动态时再合并其评价
+    FEED_FANOUT_MAX_FOLLOWERS = 5000
+
     # ELASTICSEARCH
     ELASTICSEARCH_URL = os.environ.get("ELASTICSEARCH_URL", "http://localhost:9200")
+    # 批量写入索引时每个请求的文档数, 全量重建索引时并行的请求数
+    ELASTICSEARCH_BULK_CHUNK_SIZE = 500
+    ELASTICSEARCH_BULK_THREAD_COUNT = 4
+    # 未配置 ELASTICSEARCH_URL 时使用的本地索引目录, web 与 celery 需共享, 为空时关闭搜索;
+    # 日志中的变更数超过 LOCAL_SEARCH_COMPACT_SIZE 且超过文档数时合并为快照
+    LOCAL_SEARCH_DIR = os.getenv(
+        "LOCAL_SEARCH_DIR", os.path.join(basedir, "data", "search")
+    )
+    LOCAL_SEARCH_COMPACT_SIZE = 10000
 
     # hashids
     HASHIDS_SALT = os.getenv("HASHIDS_SALT", "this is my salt")
 
     # flask-restful
     BUNDLE_ERRORS = True
+    # 分页总数的缓存时间, 同一查询在该时间内不再执行 COUNT(*)
+    PAGINATION_COUNT_TIMEOUT = 60
+    # 搜索结果 id 的缓存时间, 相同的查询(忽略大小写与多余空格)不再请求 elasticsearch
+    SEARCH_HIT_CACHE_TIMEOUT = 60
+
+    # 登录用户信息在 redis 中的缓存时间, 修改用户信息时失效
+    AUTH_CACHE_TIMEOUT = 60 * 5
+
+    # 统计每个请求的 SQL 查询数, redis 命令数和 elasticsearch 耗时
+    INSTRUMENTATION = os.getenv("INSTRUMENTATION", "true").lower() == "true"
+    # 在响应头 Server-Timing 中返回统计结果
+    INSTRUMENTATION_SERVER_TIMING = (
+        os.getenv("INSTRUMENTATION_SERVER_TIMING", "true").lower() == "true"
+    )
 
 
 class DevelopmentConfig(BaseConfig):
@@ -115,6 +195,30 @@ class TestingConfig(BaseConfig):
     )
 
 
+class BenchmarkConfig(BaseConfig):
+    ADMIN_EMAIL = "cxxlxx0@gmail.com"
+
+    # 关闭接口缓存, 每次请求都执行查询
+    CACHE_TYPE = "null"
+    # celery 任务只进入进程内的队列, 不会执行; 需要的数据由 benchmarks/run.py 显式生成
+    CELERY_BROKER_URL = "memory://"
+    CELERY_RESULT_BACKEND = "cache+memory://"
+    ELASTICSEARCH_URL = None
+    # 使用独立的 redis 库, 运行前会被清空
+    REDIS_URL = BaseConfig.REDIS_URL[: -len("/0")] + "/15"
+    ITEM_CF_SNAPSHOT_DIR = os.path.join(basedir, "data", "item-cf-bench")
+    LOCAL_SEARCH_DIR = os.path.join(basedir, "data", "search-bench")
+
+    # SQLALCHEMY DATABASE SETTINGS
+    SQLALCHEMY_DATABASE_URI = "mysql+pymysql://{username}:{password}@{host}:{port}/{database}_bench?charset=utf8mb4".format(
+        username=os.getenv("MYSQL_USERNAME", "root"),
+        password=os.getenv("MYSQL_PASSWORD", "123456"),
+        host=os.getenv("MYSQL_HOST", "127.0.0.1"),
+        port=os.getenv("MYSQL_PORT", "3306"),
+        database=os.getenv("MYSQL_DATABASE", "movies_recommend_system"),
+    )
+
+
 class ProductionConfig(BaseConfig):
     ADMIN_EMAIL = "cxxlxx0@gmail.com"
 
@@ -131,5 +235,6 @@ class ProductionConfig(BaseConfig):
 config = {
     "development": DevelopmentConfig,
     "testing": TestingConfig,
+    "benchmark": BenchmarkConfig,
     "production": ProductionConfig,
 }
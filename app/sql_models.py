@@ -8,13 +8,16 @@ from tqdm import tqdm
 from flask import current_app, g, url_for
 from itsdangerous import BadSignature, SignatureExpired
 from itsdangerous import TimedJSONWebSignatureSerializer as Serializer
-from sqlalchemy import or_, UniqueConstraint
+from sqlalchemy import or_, case, inspect, select, UniqueConstraint
+from sqlalchemy.orm import make_transient_to_detached, object_session
 from sqlalchemy.sql import func
-from sqlalchemy.dialects.mysql import TINYINT, MEDIUMBLOB
+from sqlalchemy.dialects.mysql import TINYINT, MEDIUMBLOB, insert
 from werkzeug.security import check_password_hash, generate_password_hash
 from elasticsearch.exceptions import NotFoundError
 
 from app.const import (
+    PERMISSION_BITS,
+    ROLE_PERMISSION_MASKS,
     ROLES_PERMISSIONS_MAP,
     MovieCinemaStatus,
     MovieType,
@@ -24,36 +27,67 @@ from app.const import (
 )
 from app.extensions import sql_db as db
 from app.extensions import cache
-from app.es_search import add_to_index, remove_from_index, query_index
+from app.es_search import bulk_index, query_index
 from app.utils.hashid import encode_id_to_str
-from app.utils.redis_utils import add_rating_to_rank_redis
+from app.utils.redis_utils import (
+    add_to_search_outbox,
+    apply_rank_increments,
+    apply_similarity_deltas,
+    delete_auth_snapshots,
+    get_auth_snapshot,
+    save_auth_snapshot,
+)
 
 
 class SearchableMixin:
     @classmethod
-    def search(cls, expression, page, per_page):
+    def search(cls, expression, page, per_page, options=()):
         """
         :param expression: query expression
         :param page: current page, start from 1
         :param per_page: count/per_page
-        :return: flask_sqlalchemy.BaseQuery, total
+        :param options: loader options of the hits, e.g. joinedload
+        :return: [objects] in the order of relevance, total
         """
-        try:
-            ids, total = query_index(cls, expression, page, per_page)
-        except NotFoundError:
-            return [], 0
-        if total == 0:
-            return cls.query.filter_by(id=-1), 0
-        when = []
-        for i in range(len(ids)):
-            when.append((ids[i], i))
-        return (
-            cls.query.filter(cls.id.in_(ids)).order_by(db.case(when, value=cls.id)),
-            total,
+        normalized = " ".join(expression.lower().split())
+        key = "search:%s:%s:%d:%d" % (
+            cls.__tablename__,
+            hashlib.md5(normalized.encode("utf-8")).hexdigest(),
+            page,
+            per_page,
+        )
+        hits = cache.get(key)
+        if hits is None:
+            try:
+                hits = query_index(cls, normalized, page, per_page)
+            except NotFoundError:
+                return [], 0
+            cache.set(key, hits, timeout=current_app.config["SEARCH_HIT_CACHE_TIMEOUT"])
+        ids, total = hits
+        if not ids:
+            return [], total
+        objs = {
+            obj.id: obj for obj in cls.query.options(*options).filter(cls.id.in_(ids))
+        }
+        # hits deleted after they were indexed are skipped
+        return [objs[obj_id] for obj_id in ids if obj_id in objs], total
+
+    @staticmethod
+    def searchable_changed(obj):
+        """
+        :return: whether a field of the es document of `obj` is changed
+        """
+        attrs = inspect(obj).attrs
+        return any(
+            attrs[field["key"]].history.has_changes() for field in obj.__searchable__
         )
 
     @classmethod
-    def before_commit(cls, session):
+    def before_flush(cls, session, flush_context=None, instances=None):
+        """
+        collect changes before every flush instead of before commit, the
+        attribute history of objects flushed by autoflush is gone at commit
+        """
         if not hasattr(session, "_changes") or session._changes is None:
             session._changes = {"add": [], "update": [], "delete": []}
         if session.new:
@@ -61,8 +95,11 @@ class SearchableMixin:
                 obj for obj in session.new if isinstance(obj, cls)
             ]
         if session.dirty:
+            # e.g. last_login_time, token_salt and updated_at are not indexed
             session._changes["update"] += [
-                obj for obj in session.dirty if isinstance(obj, cls)
+                obj
+                for obj in session.dirty
+                if isinstance(obj, cls) and cls.searchable_changed(obj)
             ]
         if session.deleted:
             session._changes["delete"] += [
@@ -72,18 +109,44 @@ class SearchableMixin:
     @classmethod
     def after_commit(cls, session):
         if hasattr(session, "_changes") and session._changes:
-            for obj in session._changes["add"]:
-                add_to_index(obj.__tablename__, obj)
-            for obj in session._changes["update"]:
-                add_to_index(obj.__tablename__, obj)
-            for obj in session._changes["delete"]:
-                remove_from_index(obj.__tablename__, obj)
+            # the changes of every searchable model are collected in the same
+            # `session._changes`, they are synced to es by `sync_search_index`
+            changes = {}
+            for op, objs in (
+                ("index", session._changes["add"] + session._changes["update"]),
+                ("delete", session._changes["delete"]),
+            ):
+                for obj in objs:
+                    identity = inspect(obj).identity
+                    # e.g. expunged before it was flushed
+                    if identity is None:
+                        continue
+                    changes.setdefault(obj.__tablename__, {})[identity[0]] = op
             session._changes = None
+            if changes:
+                add_to_search_outbox(changes)
+
+    @staticmethod
+    def after_rollback(session):
+        """
+        the changes collected by `before_flush` are not committed
+        """
+        session._changes = None
 
     @classmethod
-    def reindex(cls):
-        for obj in cls.query:
-            add_to_index(cls.__tablename__, obj)
+    def reindex(cls, chunk_size=None, thread_count=None):
+        """
+        index every row, streamed from mysql in chunks
+        :return: (count of indexed rows, ids of failed rows)
+        """
+        chunk_size = chunk_size or current_app.config["ELASTICSEARCH_BULK_CHUNK_SIZE"]
+        return bulk_index(
+            cls.__tablename__,
+            cls.query.order_by(cls.id).yield_per(chunk_size),
+            chunk_size=chunk_size,
+            thread_count=thread_count
+            or current_app.config["ELASTICSEARCH_BULK_THREAD_COUNT"],
+        )
 
 
 class MyBaseModel(db.Model):
@@ -132,6 +195,18 @@ class Role(MyBaseModel):
                     db.session.add(role)
         db.session.commit()
 
+    @staticmethod
+    def get_roles(role_name):
+        """
+        :param role_name: ROLES_PERMISSIONS_MAP.keys()
+        :return: list of Role, the roles are created if the table is empty
+        """
+        roles = Role.query.filter_by(role_name=role_name).all()
+        if not roles:
+            Role.init_role()
+            roles = Role.query.filter_by(role_name=role_name).all()
+        return roles
+
 
 followers = db.Table(
     "followers",
@@ -156,6 +231,16 @@ class Notification(MyBaseModel):
     )
     rating = db.relationship("Rating", backref="notification", lazy=True)
 
+    __table_args__ = (
+        # keyset pagination of the notifications received
+        db.Index(
+            "ix_notification_receiver_user_id_category_created_at",
+            "receiver_user_id",
+            "category",
+            "created_at",
+        ),
+    )
+
     @staticmethod
     def create_one(receiver_user_id, sender_user_id, category, rating_id=None):
         """
@@ -362,16 +447,91 @@ class User(SearchableMixin, MyBaseModel):
             return None
         except BadSignature:
             return None
-        current_user = User.query.filter_by(id=data["uid"]).first()
-        if current_user is None:
-            return None
-        else:
-            token_salt = data.get("token_salt")
-            if token_salt == current_user.token_salt:
-                g.current_user = current_user
-                return current_user
-            else:
+        token_salt = data.get("token_salt")
+        current_user = User._from_auth_snapshot(get_auth_snapshot(data["uid"]))
+        if current_user is None or current_user.token_salt != token_salt:
+            current_user = User.query.filter_by(id=data["uid"]).first()
+            if current_user is None:
                 return None
+            save_auth_snapshot(
+                current_user.id,
+                current_user._to_auth_snapshot(),
+                current_app.config["AUTH_CACHE_TIMEOUT"],
+            )
+        if token_salt == current_user.token_salt:
+            g.current_user = current_user
+            return current_user
+        else:
+            return None
+
+    # columns cached in redis for authentication, password_hash is never cached
+    _AUTH_SNAPSHOT_COLUMNS = (
+        "id",
+        "username",
+        "email",
+        "token_salt",
+        "avatar_image_id",
+        "email_confirmed",
+        "signature",
+        "city_id",
+    )
+    _AUTH_SNAPSHOT_DATETIME_COLUMNS = ("created_at", "updated_at", "last_login_time")
+    _AUTH_SNAPSHOT_DATETIME_FORMAT = "%Y-%m-%d %H:%M:%S.%f"
+
+    def _to_auth_snapshot(self):
+        snapshot = {key: getattr(self, key) for key in User._AUTH_SNAPSHOT_COLUMNS}
+        snapshot["role_name"] = self.role_name
+        for key in User._AUTH_SNAPSHOT_DATETIME_COLUMNS:
+            value = getattr(self, key)
+            snapshot[key] = (
+                value.strftime(User._AUTH_SNAPSHOT_DATETIME_FORMAT) if value else None
+            )
+        return snapshot
+
+    @staticmethod
+    def _from_auth_snapshot(snapshot):
+        """
+        rebuild a persistent user from the snapshot without query, columns not
+        in the snapshot are loaded when accessed
+        :param snapshot: dict returned by `_to_auth_snapshot`
+        :return: User or None
+        """
+        if snapshot is None:
+            return None
+        # do not call __init__, it sets role for a new user
+        user = inspect(User).class_manager.new_instance()
+        for key in User._AUTH_SNAPSHOT_COLUMNS:
+            setattr(user, key, snapshot[key])
+        for key in User._AUTH_SNAPSHOT_DATETIME_COLUMNS:
+            value = snapshot[key]
+            setattr(
+                user,
+                key,
+                (
+                    datetime.strptime(value, User._AUTH_SNAPSHOT_DATETIME_FORMAT)
+                    if value
+                    else None
+                ),
+            )
+        make_transient_to_detached(user)
+        user = db.session.merge(user, load=False)
+        user._role_name = snapshot.get("role_name")
+        return user
+
+    @staticmethod
+    def invalidate_auth_snapshot(mapper, connection, target):
+        """
+        drop the snapshot when the user is changed, and once more after commit
+        in case another request cached the old row before this commit
+        """
+        delete_auth_snapshots([target.id])
+        session = object_session(target)
+        if session is not None:
+            session.info.setdefault("auth_snapshot_user_ids", set()).add(target.id)
+
+    @staticmethod
+    def after_commit_invalidate_auth_snapshot(session):
+        delete_auth_snapshots(list(session.info.pop("auth_snapshot_user_ids", ())))
 
     def revoke_auth_token(self):
         self.token_salt += 1
@@ -440,14 +600,11 @@ class User(SearchableMixin, MyBaseModel):
         set role for user when create a user.
         :return: None
         """
-        if Role.query.count() == 0:
-            Role.init_role()
         if len(self.roles) == 0:
             if self.email == current_app.config["ADMIN_EMAIL"]:
-                current_roles = Role.query.filter_by(role_name="Administrator")
+                self.roles += Role.get_roles("Administrator")
             else:
-                current_roles = Role.query.filter_by(role_name="User")
-            self.roles += current_roles
+                self.roles += Role.get_roles("User")
 
     def change_role(self, role_name):
         """
@@ -455,10 +612,8 @@ class User(SearchableMixin, MyBaseModel):
         :param role_name: ROLES_PERMISSIONS_MAP.keys()
         """
         self.roles.clear()
-        if Role.query.count() == 0:
-            Role.init_role()
-        current_roles = Role.query.filter_by(role_name=role_name.title())
-        self.roles += current_roles
+        self.roles += Role.get_roles(role_name.title())
+        self._role_name = None
 
     def follow(self, user):
         """
@@ -536,7 +691,7 @@ class User(SearchableMixin, MyBaseModel):
             category=RatingType.WISH,
             tags_name=tags_name,
         )
-        add_rating_to_rank_redis(movie)
+        self._add_rating_to_similarity(movie)
         return True
 
     def do_movie(self, movie, score=0, comment=None, tags_name=[]):
@@ -560,7 +715,7 @@ class User(SearchableMixin, MyBaseModel):
             category=RatingType.DO,
             tags_name=tags_name,
         )
-        add_rating_to_rank_redis(movie)
+        self._add_rating_to_similarity(movie)
         return True
 
     def collect_movie(self, movie, score=0, comment=None, tags_name=[]):
@@ -582,7 +737,7 @@ class User(SearchableMixin, MyBaseModel):
             category=RatingType.COLLECT,
             tags_name=tags_name,
         )
-        add_rating_to_rank_redis(movie)
+        self._add_rating_to_similarity(movie)
         return True
 
     def delete_rating_on(self, movie):
@@ -595,14 +750,41 @@ class User(SearchableMixin, MyBaseModel):
         if not rating:
             return False
         self.ratings.remove(rating)
-        add_rating_to_rank_redis(movie, True)
+        self._add_rating_to_similarity(movie, True)
         return True
 
+    def _add_rating_to_similarity(self, movie, dec=False):
+        """
+        record the co-occurrence delta of rating/unrating `movie` for item-cf,
+        applied to redis after the transaction commits
+        :param movie: Movie
+        :param dec: set True when delete rating
+        """
+        rated_movie_ids = [
+            movie_id
+            for (movie_id,) in self.ratings.with_entities(Rating.movie_id)
+            if movie_id != movie.id
+        ]
+        db.session.info.setdefault("similarity_deltas", []).append(
+            (self.id, movie.id, rated_movie_ids, -1 if dec else 1)
+        )
+
+    @staticmethod
+    def after_commit_apply_similarity(session):
+        """
+        the recommendation of the dirty users is refreshed from mysql, so the
+        deltas are applied once the ratings are visible
+        """
+        deltas = session.info.pop("similarity_deltas", None)
+        if deltas:
+            apply_similarity_deltas(deltas)
+
     @property
     def role_name(self):
-        if not self.roles:
-            return
-        return self.roles[0].role_name
+        role_name = getattr(self, "_role_name", None)
+        if role_name is None and self.roles:
+            role_name = self._role_name = self.roles[0].role_name
+        return role_name
 
     @property
     def is_locked(self):
@@ -624,7 +806,10 @@ class User(SearchableMixin, MyBaseModel):
 
     def check_permission(self, permission):
         """Check Permission"""
-        return permission.upper() in [role.permission for role in self.roles]
+        return bool(
+            ROLE_PERMISSION_MASKS.get(self.role_name, 0)
+            & PERMISSION_BITS.get(permission.upper(), 0)
+        )
 
     def _gen_email_hashgravatar(self, size=500):
         """
@@ -643,7 +828,7 @@ class User(SearchableMixin, MyBaseModel):
         """
         thumb avatar
         """
-        if not self.avatar:
+        if not self.avatar_image_id:
             return self._gen_email_hashgravatar(100)
         else:
             return url_for(
@@ -657,7 +842,7 @@ class User(SearchableMixin, MyBaseModel):
         """
         avatar image
         """
-        if not self.avatar:
+        if not self.avatar_image_id:
             return self._gen_email_hashgravatar(1000)
         else:
             return url_for(
@@ -930,15 +1115,26 @@ class Movie(SearchableMixin, MyBaseModel):
 
     @property
     def score(self):
-        score = (
-            self.ratings.filter_by(category=RatingType.COLLECT)
-            .with_entities(func.avg(Rating.score))
-            .all()[0][0]
-        )
-        try:
-            return float(score)
-        except TypeError:
+        if self.score_info is None or not self.score_info.score_count:
             return 0
+        # same precision as AVG() of mysql
+        return round(self.score_info.score_sum / self.score_info.score_count, 4)
+
+    @property
+    def rating_count(self):
+        return self.wish_count + self.do_count + self.collect_count
+
+    @property
+    def wish_count(self):
+        return self.score_info.wish_count if self.score_info else 0
+
+    @property
+    def do_count(self):
+        return self.score_info.do_count if self.score_info else 0
+
+    @property
+    def collect_count(self):
+        return self.score_info.collect_count if self.score_info else 0
 
     @property
     def user_do_rating_query(self):
@@ -958,10 +1154,204 @@ class Movie(SearchableMixin, MyBaseModel):
             "api.Photo", image_hash_id=encode_id_to_str(self.image_id), _external=True
         )
 
+    def set_rating_of(self, user, rating):
+        """
+        cache the rating of the user on this movie, prefetched for a page of movies
+        :param user: User
+        :param rating: Rating or None
+        """
+        if getattr(self, "_rating_of", None) is None:
+            self._rating_of = {}
+        self._rating_of[user.id] = rating
+
+    def rating_of(self, user):
+        """
+        :param user: User
+        :return: Rating of the user on this movie or None
+        """
+        rating_of = getattr(self, "_rating_of", None) or {}
+        if user.id in rating_of:
+            return rating_of[user.id]
+        return self.ratings.filter_by(user_id=user.id).first()
+
     def __repr__(self):
         return "<Movie %r>" % self.title
 
 
+class MovieScore(MyBaseModel):
+    """
+    Table: rating aggregate of every movie, `score` is the average score of
+    collect ratings and NULL when the movie has not been collected
+    """
+
+    __tablename__ = "movie_scores"
+    movie_id = db.Column(
+        db.Integer,
+        db.ForeignKey("movies.id", ondelete="CASCADE"),
+        unique=True,
+        nullable=False,
+    )
+    movie = db.relationship(
+        "Movie",
+        backref=db.backref("score_info", uselist=False, cascade="all, delete-orphan"),
+        lazy=True,
+    )
+    wish_count = db.Column(db.Integer, default=0, nullable=False)
+    do_count = db.Column(db.Integer, default=0, nullable=False)
+    collect_count = db.Column(db.Integer, default=0, nullable=False)
+    score_sum = db.Column(db.Integer, default=0, nullable=False)
+    # count of collect ratings with a score
+    score_count = db.Column(db.Integer, default=0, nullable=False)
+    score = db.Column(db.Float, nullable=True, index=True)
+
+    @staticmethod
+    def rebuild():
+        """
+        recompute the aggregate of every movie from table ratings but not commit
+        :return: count of changed rows
+        """
+        category_fields = {
+            RatingType.WISH: "wish_count",
+            RatingType.DO: "do_count",
+            RatingType.COLLECT: "collect_count",
+        }
+        empty = dict.fromkeys(
+            ("wish_count", "do_count", "collect_count", "score_sum", "score_count"), 0
+        )
+        aggregates = {}
+        for movie_id, category, count, score_sum, score_count in (
+            db.session.query(
+                Rating.movie_id,
+                Rating.category,
+                func.count(Rating.id),
+                func.sum(Rating.score),
+                func.count(Rating.score),
+            )
+            .group_by(Rating.movie_id, Rating.category)
+            .all()
+        ):
+            aggregate = aggregates.setdefault(movie_id, dict(empty))
+            aggregate[category_fields[category]] = count
+            if category == RatingType.COLLECT:
+                aggregate["score_sum"] = int(score_sum or 0)
+                aggregate["score_count"] = score_count
+        changed = 0
+        for movie_score in MovieScore.query:
+            aggregate = aggregates.pop(movie_score.movie_id, empty)
+            if movie_score.update_from(**aggregate):
+                changed += 1
+        for movie_id, aggregate in aggregates.items():
+            movie_score = MovieScore(movie_id=movie_id)
+            movie_score.update_from(**aggregate)
+            db.session.add(movie_score)
+            changed += 1
+        return changed
+
+    def update_from(self, wish_count, do_count, collect_count, score_sum, score_count):
+        """
+        :return: True if any counter is changed
+        """
+        counters = {
+            "wish_count": wish_count,
+            "do_count": do_count,
+            "collect_count": collect_count,
+            "score_sum": score_sum,
+            "score_count": score_count,
+        }
+        changed = False
+        for key, value in counters.items():
+            if getattr(self, key) != value:
+                setattr(self, key, value)
+                changed = True
+        if changed:
+            self.score = score_sum / score_count if score_count else None
+        return changed
+
+    @staticmethod
+    def apply_rating(connection, movie_id, category, score, sign):
+        """
+        add (sign=1) or remove (sign=-1) one rating from the aggregate of the
+        movie with a single atomic upsert
+        :param connection: connection of the flushing session
+        :param movie_id: Rating.movie_id
+        :param category: Rating.category
+        :param score: Rating.score
+        :param sign: 1 or -1
+        """
+        table = MovieScore.__table__
+        deltas = {
+            "wish_count": sign if category == RatingType.WISH else 0,
+            "do_count": sign if category == RatingType.DO else 0,
+            "collect_count": sign if category == RatingType.COLLECT else 0,
+            "score_sum": 0,
+            "score_count": 0,
+        }
+        if category == RatingType.COLLECT and score is not None:
+            deltas["score_sum"] = sign * score
+            deltas["score_count"] = sign
+        now = datetime.utcnow()
+        values = {key: max(delta, 0) for key, delta in deltas.items()}
+        stmt = insert(table).values(
+            movie_id=movie_id,
+            created_at=now,
+            score=(
+                values["score_sum"] / values["score_count"]
+                if values["score_count"]
+                else None
+            ),
+            **values
+        )
+        # mysql evaluates the assignments from left to right, `score` reads
+        # the updated score_sum and score_count
+        stmt = stmt.on_duplicate_key_update(
+            [(key, table.c[key] + delta) for key, delta in deltas.items()]
+            + [
+                (
+                    "score",
+                    case(
+                        [
+                            (
+                                table.c.score_count > 0,
+                                table.c.score_sum / table.c.score_count,
+                            )
+                        ],
+                        else_=None,
+                    ),
+                ),
+                ("updated_at", now),
+            ]
+        )
+        connection.execute(stmt)
+
+    @staticmethod
+    def after_rating_insert(mapper, connection, target):
+        MovieScore.apply_rating(
+            connection, target.movie_id, target.category, target.score, 1
+        )
+
+    @staticmethod
+    def after_rating_delete(mapper, connection, target):
+        MovieScore.apply_rating(
+            connection, target.movie_id, target.category, target.score, -1
+        )
+
+    @staticmethod
+    def after_rating_update(mapper, connection, target):
+        state = inspect(target)
+        old = []
+        for key in ("movie_id", "category", "score"):
+            history = state.attrs[key].history
+            old.append(history.deleted[0] if history.deleted else getattr(target, key))
+        new = [target.movie_id, target.category, target.score]
+        if old == new:
+            return
+        MovieScore.apply_rating(connection, *old, -1)
+        MovieScore.apply_rating(connection, *new, 1)
+
+    def __repr__(self):
+        return "<MovieScore %r>" % self.movie_id
+
+
 class Tag(MyBaseModel):
     __tablename__ = "tags"
     tag_name = db.Column(db.String(8), unique=True, nullable=False, index=True)
@@ -1033,6 +1423,8 @@ class Rating(MyBaseModel):
     score = db.Column(db.Integer, default=0)
     comment = db.Column(db.Text, default="")
     category = db.Column(TINYINT(1), default=2)  # 0=wish, 1=do, 2=collect
+    # count of rating_likes, updated by like_by/unlike_by
+    like_count = db.Column(db.Integer, nullable=False, default=0, server_default="0")
     tags = db.relationship(
         "Tag",
         secondary="rating_tags",
@@ -1052,7 +1444,20 @@ class Rating(MyBaseModel):
         lazy="dynamic",
     )
 
-    __table_args__ = (UniqueConstraint("user_id", "movie_id", "category"),)
+    __table_args__ = (
+        UniqueConstraint("user_id", "movie_id", "category"),
+        # keyset pagination of the ratings of one movie
+        db.Index("ix_ratings_movie_id_created_at", "movie_id", "created_at"),
+        # hot sort of the ratings of one movie
+        db.Index(
+            "ix_ratings_movie_id_category_like_count",
+            "movie_id",
+            "category",
+            "like_count",
+        ),
+        # hot sort of all ratings of one movie, without a category
+        db.Index("ix_ratings_movie_id_like_count", "movie_id", "like_count", "id"),
+    )
 
     def __repr__(self):
         return "<Rating %r>" % self.comment
@@ -1087,6 +1492,8 @@ class Rating(MyBaseModel):
         if self.like_by_users.filter_by(id=user.id).first():
             return False
         self.like_by_users.append(user)
+        # UPDATE ... SET like_count = like_count + 1 when flushed
+        self.like_count = Rating.like_count + 1
         notification = Notification.create_one(
             self.user_id, user.id, NotificationType.RATING_ACTION, rating_id=self.id
         )
@@ -1103,6 +1510,7 @@ class Rating(MyBaseModel):
         if not self.like_by_users.filter_by(id=user.id).first():
             return False
         self.like_by_users.remove(user)
+        self.like_count = Rating.like_count - 1
         notification = Notification.query.filter_by(
             receiver_user_id=self.user.id,
             sender_user_id=user.id,
@@ -1125,20 +1533,134 @@ class Rating(MyBaseModel):
         self.report_by_users.append(user)
         return True
 
-    @property
-    def like_count(self):
-        return self.like_by_users.count()
+    def set_liked_by(self, user, liked):
+        """
+        cache whether the user liked this rating, prefetched for a page of ratings
+        :param user: User
+        :param liked: True or False
+        """
+        if getattr(self, "_liked_by", None) is None:
+            self._liked_by = {}
+        self._liked_by[user.id] = liked
+
+    def is_liked_by(self, user):
+        """
+        :param user: User
+        :return: True or False
+        """
+        liked_by = getattr(self, "_liked_by", None) or {}
+        if user.id in liked_by:
+            return liked_by[user.id]
+        return self.like_by_users.filter_by(id=user.id).first() is not None
+
+    @staticmethod
+    def rebuild_like_counts():
+        """
+        recompute like_count of the ratings from table rating_likes but not
+        commit, e.g. after users are deleted with their likes
+        :return: count of changed rows
+        """
+        count = (
+            select([func.count(rating_likes.c.id)])
+            .where(rating_likes.c.rating_id == Rating.id)
+            .as_scalar()
+        )
+        return Rating.query.filter(Rating.like_count != count).update(
+            {Rating.like_count: count}, synchronize_session=False
+        )
 
     @property
     def report_count(self):
         return self.report_by_users.count()
 
+    @staticmethod
+    def record_rank_insert(mapper, connection, target):
+        session = object_session(target)
+        if session is not None:
+            increments = session.info.setdefault("rank_increments", {})
+            increments[target.movie_id] = increments.get(target.movie_id, 0) + 1
+
+    @staticmethod
+    def record_rank_delete(mapper, connection, target):
+        session = object_session(target)
+        if session is not None:
+            increments = session.info.setdefault("rank_increments", {})
+            increments[target.movie_id] = increments.get(target.movie_id, 0) - 1
+
+    @staticmethod
+    def after_commit_apply_rank(session):
+        """
+        apply the rating count changes of the whole transaction to the
+        leaderboards by one pipeline
+        """
+        increments = session.info.pop("rank_increments", None)
+        if increments:
+            apply_rank_increments(increments)
+
+    @staticmethod
+    def record_timeline_insert(mapper, connection, target):
+        session = object_session(target)
+        if session is not None:
+            session.info.setdefault("timeline_new_rating_ids", []).append(target.id)
+
+    @staticmethod
+    def record_timeline_delete(mapper, connection, target):
+        session = object_session(target)
+        if session is not None:
+            session.info.setdefault("timeline_deleted_ratings", {}).setdefault(
+                target.user_id, []
+            ).append(target.id)
 
-db.event.listen(db.session, "before_commit", User.before_commit)
+    @staticmethod
+    def after_commit_fan_out(session):
+        """
+        update the follow feed timelines once the ratings are visible to the
+        celery workers
+        """
+        rating_ids = session.info.pop("timeline_new_rating_ids", None)
+        deleted = session.info.pop("timeline_deleted_ratings", None)
+        if not rating_ids and not deleted:
+            return
+        from app.tasks.feed import fan_out_ratings, remove_ratings_from_timelines
+
+        if rating_ids:
+            fan_out_ratings.delay(rating_ids)
+        for user_id, ids in (deleted or {}).items():
+            remove_ratings_from_timelines.delay(user_id, ids)
+
+    @staticmethod
+    def after_rollback_discard(session):
+        session.info.pop("rank_increments", None)
+        session.info.pop("similarity_deltas", None)
+        session.info.pop("timeline_new_rating_ids", None)
+        session.info.pop("timeline_deleted_ratings", None)
+        session.info.pop("auth_snapshot_user_ids", None)
+
+
+db.event.listen(db.session, "before_flush", User.before_flush)
 db.event.listen(db.session, "after_commit", User.after_commit)
 
-db.event.listen(db.session, "before_commit", Movie.before_commit)
+db.event.listen(db.session, "before_flush", Movie.before_flush)
 db.event.listen(db.session, "after_commit", Movie.after_commit)
 
-db.event.listen(db.session, "before_commit", Celebrity.before_commit)
+db.event.listen(db.session, "before_flush", Celebrity.before_flush)
 db.event.listen(db.session, "after_commit", Celebrity.after_commit)
+db.event.listen(db.session, "after_rollback", SearchableMixin.after_rollback)
+
+db.event.listen(Rating, "after_insert", MovieScore.after_rating_insert)
+db.event.listen(Rating, "after_delete", MovieScore.after_rating_delete)
+db.event.listen(Rating, "after_update", MovieScore.after_rating_update)
+
+db.event.listen(User, "after_update", User.invalidate_auth_snapshot)
+db.event.listen(User, "after_delete", User.invalidate_auth_snapshot)
+db.event.listen(db.session, "after_commit", User.after_commit_invalidate_auth_snapshot)
+
+db.event.listen(Rating, "after_insert", Rating.record_rank_insert)
+db.event.listen(Rating, "after_delete", Rating.record_rank_delete)
+db.event.listen(db.session, "after_commit", Rating.after_commit_apply_rank)
+db.event.listen(db.session, "after_commit", User.after_commit_apply_similarity)
+
+db.event.listen(Rating, "after_insert", Rating.record_timeline_insert)
+db.event.listen(Rating, "after_delete", Rating.record_timeline_delete)
+db.event.listen(db.session, "after_commit", Rating.after_commit_fan_out)
+db.event.listen(db.session, "after_rollback", Rating.after_rollback_discard)
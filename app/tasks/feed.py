@@ -0,0 +1,197 @@
+from contextlib import contextmanager
+
+from flask import current_app
+from sqlalchemy.sql import func
+
+from app import celery
+from app.extensions import sql_db
+from app.sql_models import Rating, followers
+from app.utils.redis_utils import (
+    get_feed_celebrities,
+    push_to_timelines,
+    remove_author_from_timeline,
+    remove_from_timelines,
+    save_timeline,
+    set_feed_celebrity,
+)
+
+
+@contextmanager
+def _task_session():
+    """
+    a session of the task's own: the tasks are dispatched from
+    `after_commit`, and when celery runs them eagerly the committed
+    `sql_db.session` can not emit sql there
+    """
+    session = sql_db.create_session({})()
+    try:
+        yield session
+    finally:
+        session.close()
+
+
+def _follower_ids(session, user_id, chunk_size):
+    """
+    :param session: Session
+    :param user_id: User.id
+    :param chunk_size: count of ids of one chunk
+    :return: generator of lists of follower ids
+    """
+    last_id = 0
+    while True:
+        rows = (
+            session.query(followers.c.id, followers.c.follower_id)
+            .filter(followers.c.followed_id == user_id, followers.c.id > last_id)
+            .order_by(followers.c.id)
+            .limit(chunk_size)
+            .all()
+        )
+        if not rows:
+            return
+        last_id = rows[-1][0]
+        yield [follower_id for _, follower_id in rows]
+
+
+def _is_celebrity(session, user_id):
+    """
+    ratings of users with too many followers are not fanned out
+    """
+    count = (
+        session.query(func.count(followers.c.id))
+        .filter(followers.c.followed_id == user_id)
+        .scalar()
+    )
+    celebrity = count > current_app.config["FEED_FANOUT_MAX_FOLLOWERS"]
+    if set_feed_celebrity(user_id, celebrity):
+        if celebrity:
+            # his ratings are merged when read from now on, the pushed ones
+            # would be counted twice
+            remove_author_from_timelines.delay(user_id)
+        else:
+            # his ratings were neither pushed nor filled while he was one
+            push_author_to_timelines.delay(user_id)
+    return celebrity
+
+
+def _newest_rating_items(session, user_id):
+    """
+    a timeline keeps the newest ratings, so only his newest ones can be in it
+    :return: [(rating_id, author_id, created_at)]
+    """
+    return (
+        session.query(Rating.id, Rating.user_id, Rating.created_at)
+        .filter(Rating.user_id == user_id)
+        .order_by(Rating.created_at.desc())
+        .limit(current_app.config["FEED_TIMELINE_SIZE"])
+        .all()
+    )
+
+
+@celery.task(ignore_result=True)
+def fan_out_ratings(rating_ids, chunk_size=1000):
+    """
+    push new ratings to the timelines of the followers of their users
+    :param rating_ids: ids of the committed ratings
+    :param chunk_size: count of followers pushed by one pipeline
+    """
+    with _task_session() as session:
+        items = {}
+        for rating_id, user_id, created_at in session.query(
+            Rating.id, Rating.user_id, Rating.created_at
+        ).filter(Rating.id.in_(rating_ids)):
+            items.setdefault(user_id, []).append((rating_id, user_id, created_at))
+        for user_id, user_items in items.items():
+            if _is_celebrity(session, user_id):
+                continue
+            for follower_ids in _follower_ids(session, user_id, chunk_size):
+                push_to_timelines(
+                    follower_ids, user_items, current_app.config["FEED_TIMELINE_SIZE"]
+                )
+
+
+@celery.task(ignore_result=True)
+def remove_ratings_from_timelines(user_id, rating_ids, chunk_size=1000):
+    """
+    :param user_id: Rating.user_id of the deleted ratings
+    :param rating_ids: ids of the deleted ratings
+    :param chunk_size: count of followers handled by one pipeline
+    """
+    with _task_session() as session:
+        for follower_ids in _follower_ids(session, user_id, chunk_size):
+            remove_from_timelines(follower_ids, rating_ids, user_id)
+
+
+@celery.task(ignore_result=True)
+def remove_author_from_timelines(user_id, chunk_size=1000):
+    """
+    drop the ratings of a user who became a celebrity from the timelines
+    :param user_id: User.id of the celebrity
+    :param chunk_size: count of followers handled by one pipeline
+    """
+    with _task_session() as session:
+        rating_ids = [item[0] for item in _newest_rating_items(session, user_id)]
+        if not rating_ids:
+            return
+        for follower_ids in _follower_ids(session, user_id, chunk_size):
+            remove_from_timelines(follower_ids, rating_ids, user_id)
+
+
+@celery.task(ignore_result=True)
+def push_author_to_timelines(user_id, chunk_size=1000):
+    """
+    push the newest ratings of a user who is no longer a celebrity to the
+    timelines of his followers
+    :param user_id: User.id
+    :param chunk_size: count of followers pushed by one pipeline
+    """
+    with _task_session() as session:
+        items = _newest_rating_items(session, user_id)
+        if not items:
+            return
+        for follower_ids in _follower_ids(session, user_id, chunk_size):
+            push_to_timelines(
+                follower_ids, items, current_app.config["FEED_TIMELINE_SIZE"]
+            )
+
+
+@celery.task(ignore_result=True)
+def fill_timeline(user_id, followed_id=None):
+    """
+    fill the timeline from mysql, when it is read before filled or the user
+    followed someone. ratings of celebrities are merged when read, they are
+    never written to timelines
+    :param user_id: User.id of the timeline
+    :param followed_id: only add the ratings of this user
+    """
+    size = current_app.config["FEED_TIMELINE_SIZE"]
+    celebrity_ids = get_feed_celebrities()
+    with _task_session() as session:
+        query = session.query(Rating.id, Rating.user_id, Rating.created_at)
+        if followed_id is not None:
+            if followed_id in celebrity_ids:
+                return
+            items = (
+                query.filter(Rating.user_id == followed_id)
+                .order_by(Rating.created_at.desc())
+                .limit(size)
+                .all()
+            )
+            # a timeline not filled yet gets these ratings when it is filled
+            push_to_timelines([user_id], items, size)
+            return
+        query = query.join(followers, Rating.user_id == followers.c.followed_id).filter(
+            followers.c.follower_id == user_id
+        )
+        if celebrity_ids:
+            query = query.filter(Rating.user_id.notin_(celebrity_ids))
+        items = query.order_by(Rating.created_at.desc()).limit(size).all()
+    save_timeline(user_id, items, size, current_app.config["FEED_TIMELINE_EXPIRE"])
+
+
+@celery.task(ignore_result=True)
+def unfollow_timeline(user_id, followed_id):
+    """
+    :param user_id: User.id of the timeline
+    :param followed_id: User.id of the unfollowed user
+    """
+    remove_author_from_timeline(user_id, followed_id)
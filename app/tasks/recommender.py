@@ -1,43 +1,238 @@
-import math
+import os
+from datetime import date, datetime, timedelta, timezone
 
-from celery import Task
+from flask import current_app
+from sqlalchemy.sql import func
 
 from app import celery
-from app.sql_models import User, Rating
-from app.utils.redis_utils import push_task_id_to_redis
+from app.extensions import sql_db
+from app.recommender import item_cf_recommendation
+from app.sql_models import MovieScore, User, Rating
+from app.utils.item_similarity import (
+    compute_cooccurrence,
+    cosine_similarity,
+    csr_to_dict,
+    rescale_rows,
+    top_k_neighbours,
+)
+from app.utils.redis_utils import (
+    finish_similarity_rebuild,
+    get_item_neighbours,
+    get_similarity_snapshot_version,
+    get_similarity_state,
+    mark_dirty_similarity_items,
+    next_similarity_snapshot_version,
+    patch_item_neighbours,
+    pop_dirty_recommendation_users,
+    pop_dirty_similarity_items,
+    publish_similarity_snapshot,
+    rebuild_rank_windows,
+    save_rank_days,
+    save_item_neighbours,
+    save_similarity_state,
+    save_user_recommendations,
+    similarity_snapshot_lock,
+    start_similarity_rebuild,
+)
+from app.utils.similarity_snapshot import (
+    SimilaritySnapshot,
+    remove_old_snapshots,
+    snapshot_arrays,
+    snapshot_path,
+    splice_rows,
+    write_snapshot_arrays,
+)
 
 
-class MyTask(Task):
-    def on_success(self, retval, task_id, args, kwargs):
-        push_task_id_to_redis("recomm-task", task_id)
-        return super(MyTask, self).on_success(retval, task_id, args, kwargs)
+def load_rating_arrays():
+    """
+    load the whole `ratings` table with one query
+    :return: (user_ids, movie_ids, scores)
+    """
+    rows = sql_db.session.query(Rating.user_id, Rating.movie_id, Rating.score).all()
+    if not rows:
+        return [], [], []
+    user_ids, movie_ids, scores = zip(*rows)
+    return user_ids, movie_ids, [score or 0 for score in scores]
 
-    def on_failure(self, exc, task_id, args, kwargs, einfo):
-        return super(MyTask, self).on_failure(exc, task_id, args, kwargs, einfo)
 
+def publish_snapshot(arrays):
+    """
+    write a new version of the memory-mapped snapshot for the web workers
+    :param arrays: (movie ids, row offsets, neighbour ids, weights)
+    """
+    directory = current_app.config["ITEM_CF_SNAPSHOT_DIR"]
+    version = next_similarity_snapshot_version()
+    write_snapshot_arrays(directory, version, arrays)
+    publish_similarity_snapshot(version)
+    remove_old_snapshots(directory)
 
-@celery.task(base=MyTask)
+
+@celery.task(ignore_result=True)
 def get_item_similarity():
+    """
+    full rebuild of the top-K neighbours of every movie, also resets the
+    state used by `update_item_similarity`
+    :return: count of movies with neighbours
+    """
+    with similarity_snapshot_lock(current_app.config["ITEM_CF_LOCK_TIMEOUT"]):
+        return _rebuild_item_similarity()
+
+
+def _rebuild_item_similarity():
     if User.query.count() < 5 or Rating.query.count() < 25:
-        return None
-    count = {}
-    N = {}
-    for user in User.query.all():
-        for rating_i in user.ratings.all():
-            N[rating_i.movie_id] = N.get(rating_i.movie_id, 0) + 1
-            for rating_j in user.ratings.all():
-                if rating_i.movie_id == rating_j.movie_id:
-                    continue
-                if not count.get(rating_i.movie_id):
-                    count[rating_i.movie_id] = {}
-                if not count[rating_i.movie_id].get(rating_j.movie_id):
-                    count[rating_i.movie_id][rating_j.movie_id] = 0
-                count[rating_i.movie_id][rating_j.movie_id] += 1
-    res = {}
-    for u, related_items in count.items():
-        for v, cij in related_items.items():
-            if not res.get(u):
-                res[u] = {}
-            res[u][v] = cij / math.sqrt(N[u] * N[v])
-
-    return res
+        return 0
+    # ratings committed after this are applied to the new state at the end
+    start_similarity_rebuild()
+    try:
+        user_ids, movie_ids, _ = load_rating_arrays()
+        item_ids, count, n = compute_cooccurrence(user_ids, movie_ids)
+        save_similarity_state(
+            csr_to_dict(item_ids, count), dict(zip(item_ids.tolist(), n.tolist()))
+        )
+    finally:
+        finish_similarity_rebuild()
+    neighbours = top_k_neighbours(
+        item_ids, cosine_similarity(count, n), current_app.config["ITEM_CF_TOP_K"]
+    )
+    save_item_neighbours(neighbours)
+    publish_snapshot(snapshot_arrays(neighbours))
+    refresh_user_recommendations.delay(full=True)
+    return len(neighbours)
+
+
+@celery.task(ignore_result=True)
+def update_item_similarity():
+    """
+    rescale only the rows of movies rated or unrated since the last run
+    :return: count of rescaled movies
+    """
+    lock = similarity_snapshot_lock(current_app.config["ITEM_CF_LOCK_TIMEOUT"])
+    # a rebuild or the previous run is still publishing, the dirty ids wait
+    if not lock.acquire(blocking=False):
+        return 0
+    try:
+        return _update_item_similarity()
+    finally:
+        lock.release()
+
+
+def _update_item_similarity():
+    dirty = pop_dirty_similarity_items()
+    if not dirty:
+        return 0
+    version = get_similarity_snapshot_version()
+    path = snapshot_path(current_app.config["ITEM_CF_SNAPSHOT_DIR"], version)
+    if version is None or not os.path.exists(path):
+        # kept for the next run, the rebuild may return early
+        mark_dirty_similarity_items(dirty)
+        return _rebuild_item_similarity()
+    try:
+        k = current_app.config["ITEM_CF_TOP_K"]
+        count_rows, n = get_similarity_state(dirty)
+        rows = rescale_rows(count_rows, n)
+        patch_item_neighbours(rows, k)
+        touched = {int(i) for i in rows}
+        for row in rows.values():
+            touched.update(int(j) for j in row)
+        # only the touched rows are replaced, the others are copied as arrays
+        publish_snapshot(
+            splice_rows(SimilaritySnapshot(path), get_item_neighbours(list(touched), k))
+        )
+    except Exception:
+        mark_dirty_similarity_items(dirty)
+        raise
+    return len(dirty)
+
+
+@celery.task(ignore_result=True)
+def refresh_user_recommendations(full=False, chunk_size=500):
+    """
+    materialize the ranked recommendation list of users into redis
+    :param full: refresh every active user instead of users who rated since
+                 the last run, used after a full similarity rebuild
+    :param chunk_size: users whose rating counts are loaded per query
+    :return: count of refreshed users
+    """
+    if full:
+        since = datetime.utcnow() - timedelta(
+            days=current_app.config["RECOMMEND_ACTIVE_DAYS"]
+        )
+        user_ids = [
+            user_id
+            for (user_id,) in User.query.filter(
+                User.last_login_time >= since
+            ).with_entities(User.id)
+        ]
+    else:
+        user_ids = pop_dirty_recommendation_users()
+    min_ratings = current_app.config["RECOMMEND_MIN_RATINGS"]
+    size = current_app.config["RECOMMEND_LIST_SIZE"]
+    expire = 60 * 60 * 24 * current_app.config["RECOMMEND_ACTIVE_DAYS"]
+    for start in range(0, len(user_ids), chunk_size):
+        chunk = user_ids[start : start + chunk_size]
+        rating_counts = dict(
+            sql_db.session.query(Rating.user_id, func.count(Rating.id))
+            .filter(Rating.user_id.in_(chunk))
+            .group_by(Rating.user_id)
+        )
+        for user_id in chunk:
+            if rating_counts.get(user_id, 0) < min_ratings:
+                save_user_recommendations(user_id, [], [], expire)
+                continue
+            movie_ids, scores = item_cf_recommendation(user_id, 10)
+            save_user_recommendations(
+                user_id, movie_ids[0:size], scores[0:size], expire
+            )
+    return len(user_ids)
+
+
+@celery.task(ignore_result=True)
+def refresh_movie_scores():
+    """
+    recompute table movie_scores used by the popularity ranking, and the like
+    counts used by the hot sort of ratings
+    :return: count of changed rows
+    """
+    changed = MovieScore.rebuild() + Rating.rebuild_like_counts()
+    sql_db.session.commit()
+    return changed
+
+
+@celery.task(ignore_result=True)
+def trim_rank_windows():
+    """
+    rebuild the rolling leaderboards from the daily keys after the day changes
+    :return: True if rebuilt
+    """
+    return rebuild_rank_windows()
+
+
+@celery.task(ignore_result=True)
+def rebuild_rank_data(days=31, chunk_size=10000):
+    """
+    recompute the daily leaderboard keys of the last `days` days from table
+    ratings in one pass, then the rolling windows
+    :param days: count of days, the daily keys expire after 31 days
+    :param chunk_size: rows fetched at a time
+    :return: count of ratings
+    """
+    today = date.today()
+    day_counts = {today - timedelta(days=i): {} for i in range(days)}
+    # the daily keys are named by the local date, ratings.created_at is utc
+    since = datetime.combine(today - timedelta(days=days - 1), datetime.min.time())
+    since = since.astimezone(timezone.utc).replace(tzinfo=None)
+    count = 0
+    for movie_id, created_at in (
+        sql_db.session.query(Rating.movie_id, Rating.created_at)
+        .filter(Rating.created_at >= since)
+        .yield_per(chunk_size)
+    ):
+        day = created_at.replace(tzinfo=timezone.utc).astimezone().date()
+        counts = day_counts.get(day)
+        if counts is not None:
+            counts[movie_id] = counts.get(movie_id, 0) + 1
+            count += 1
+    save_rank_days(day_counts)
+    rebuild_rank_windows(force=True)
+    return count
@@ -0,0 +1,55 @@
+from flask import current_app
+
+from app import celery
+from app.es_search import bulk_index, search_enabled
+from app.sql_models import Celebrity, Movie, User
+from app.utils.redis_utils import pop_search_outbox, requeue_search_outbox
+
+SEARCHABLE_MODELS = {model.__tablename__: model for model in (User, Movie, Celebrity)}
+
+
+def _sync_chunk(model, ops):
+    """
+    :param model: searchable model
+    :param ops: {id: "index" or "delete"}
+    :return: ids failed to sync
+    """
+    ids = [model_id for model_id, op in ops.items() if op == "index"]
+    models = model.query.filter(model.id.in_(ids)).all() if ids else []
+    # rows deleted after the change was queued are removed from es as well
+    loaded_ids = {obj.id for obj in models}
+    removed_ids = [model_id for model_id in ops if model_id not in loaded_ids]
+    _, failed = bulk_index(model.__tablename__, models, removed_ids)
+    return failed
+
+
+@celery.task(ignore_result=True)
+def sync_search_index(chunk_size=None):
+    """
+    sync the changes queued by `SearchableMixin.after_commit` to es, failed
+    changes are queued again and retried by the next run
+    :param chunk_size: count of documents loaded and sent by one request
+    """
+    if not search_enabled():
+        return
+    chunk_size = chunk_size or current_app.config["ELASTICSEARCH_BULK_CHUNK_SIZE"]
+    for index, model in SEARCHABLE_MODELS.items():
+        ops = pop_search_outbox(index)
+        model_ids = sorted(ops)
+        for i in range(0, len(model_ids), chunk_size):
+            chunk = {
+                model_id: ops[model_id] for model_id in model_ids[i : i + chunk_size]
+            }
+            try:
+                failed = _sync_chunk(model, chunk)
+            except Exception:
+                # es or mysql is unavailable, retry the rest of the batch later
+                current_app.logger.exception("failed to sync index %s", index)
+                requeue_search_outbox(
+                    index, {model_id: ops[model_id] for model_id in model_ids[i:]}
+                )
+                break
+            if failed:
+                requeue_search_outbox(
+                    index, {model_id: ops[model_id] for model_id in failed}
+                )
@@ -13,3 +13,13 @@ def decode_str_to_id(str):
         return hashids.decode(str)[0]
     except IndexError:
         return
+
+
+def encode_ids_to_str(ids):
+    hashids = Hashids(salt=current_app.config["HASHIDS_SALT"], min_length=16)
+    return hashids.encode(*ids)
+
+
+def decode_str_to_ids(str):
+    hashids = Hashids(salt=current_app.config["HASHIDS_SALT"], min_length=16)
+    return hashids.decode(str)
@@ -0,0 +1,125 @@
+"""
+per-request counters of sql queries, redis commands and elasticsearch requests,
+reported in the `Server-Timing` header, the request log and per-endpoint stats
+"""
+import time
+
+from flask import current_app, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from app.extensions import redis_store
+from app.utils.redis_utils import add_endpoint_stats
+
+_FIELDS = ("db_count", "db_time", "redis_count", "es_count", "es_time")
+
+
+def _add(key, value):
+    if has_request_context() and getattr(g, "_perf", None) is not None:
+        g._perf[key] += value
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    # kept on the execution context, which is dropped with it if the statement
+    # raises
+    context._query_start_time = time.perf_counter()
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    start = context._query_start_time
+    _add("db_count", 1)
+    _add("db_time", time.perf_counter() - start)
+
+
+def _instrument_redis(client):
+    execute_command = client.execute_command
+    pipeline = client.pipeline
+
+    def instrumented_execute_command(*args, **kwargs):
+        _add("redis_count", 1)
+        return execute_command(*args, **kwargs)
+
+    def instrumented_pipeline(*args, **kwargs):
+        pipe = pipeline(*args, **kwargs)
+        execute = pipe.execute
+
+        def instrumented_execute(*execute_args, **execute_kwargs):
+            _add("redis_count", len(pipe.command_stack))
+            return execute(*execute_args, **execute_kwargs)
+
+        pipe.execute = instrumented_execute
+        return pipe
+
+    client.execute_command = instrumented_execute_command
+    client.pipeline = instrumented_pipeline
+
+
+def _instrument_elasticsearch(client):
+    perform_request = client.transport.perform_request
+
+    def instrumented_perform_request(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return perform_request(*args, **kwargs)
+        finally:
+            _add("es_count", 1)
+            _add("es_time", time.perf_counter() - start)
+
+    client.transport.perform_request = instrumented_perform_request
+
+
+def _server_timing(perf, total):
+    return ", ".join(
+        [
+            'db;dur=%.1f;desc="%d queries"'
+            % (perf["db_time"] * 1000, perf["db_count"]),
+            'redis;desc="%d commands"' % perf["redis_count"],
+            'es;dur=%.1f;desc="%d requests"'
+            % (perf["es_time"] * 1000, perf["es_count"]),
+            "total;dur=%.1f" % (total * 1000),
+        ]
+    )
+
+
+def init_instrumentation(app):
+    """
+    :param app: the instance of ``Flask``, called after the extensions and
+                elasticsearch are initialized
+    """
+    if not app.config["INSTRUMENTATION"]:
+        return
+    _instrument_redis(redis_store._redis_client)
+    if app.elasticsearch:
+        _instrument_elasticsearch(app.elasticsearch)
+
+    @app.before_request
+    def start_instrumentation():
+        g._perf = dict.fromkeys(_FIELDS, 0)
+        g._perf_start = time.perf_counter()
+
+    @app.after_request
+    def report_instrumentation(response):
+        perf = getattr(g, "_perf", None)
+        if perf is None:
+            return response
+        g._perf = None
+        total = time.perf_counter() - g._perf_start
+        endpoint = request.endpoint or "unknown"
+        if current_app.config["INSTRUMENTATION_SERVER_TIMING"]:
+            response.headers["Server-Timing"] = _server_timing(perf, total)
+        current_app.logger.info(
+            "endpoint=%s status=%d total_ms=%.1f db_queries=%d db_ms=%.1f "
+            "redis_commands=%d es_requests=%d es_ms=%.1f",
+            endpoint,
+            response.status_code,
+            total * 1000,
+            perf["db_count"],
+            perf["db_time"] * 1000,
+            perf["redis_count"],
+            perf["es_count"],
+            perf["es_time"] * 1000,
+        )
+        add_endpoint_stats(endpoint, dict(perf, total_time=total))
+        return response
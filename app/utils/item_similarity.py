@@ -0,0 +1,144 @@
+import math
+
+import numpy as np
+from scipy import sparse
+
+
+def build_user_item_matrix(user_ids, movie_ids):
+    """
+    build a sparse user x item matrix from the rating arrays
+    :param user_ids: array of Rating.user_id
+    :param movie_ids: array of Rating.movie_id, same length as `user_ids`
+    :return: (csr matrix, array of movie id for every column)
+    """
+    user_ids = np.asarray(user_ids, dtype=np.int64)
+    movie_ids = np.asarray(movie_ids, dtype=np.int64)
+    _, user_index = np.unique(user_ids, return_inverse=True)
+    item_ids, item_index = np.unique(movie_ids, return_inverse=True)
+    matrix = sparse.coo_matrix(
+        (np.ones(len(movie_ids), dtype=np.int64), (user_index, item_index)),
+        shape=(int(user_index.max()) + 1 if len(user_index) else 0, len(item_ids)),
+    ).tocsr()  # duplicated (user, movie) pairs are summed
+    return matrix, item_ids
+
+
+def compute_cooccurrence(user_ids, movie_ids):
+    """
+    count how many users rated both item i and item j
+    :param user_ids: array of Rating.user_id
+    :param movie_ids: array of Rating.movie_id
+    :return: (array of movie id, csr co-occurrence matrix without diagonal, N)
+    """
+    matrix, item_ids = build_user_item_matrix(user_ids, movie_ids)
+    count = (matrix.T @ matrix).tocsr()
+    count.setdiag(0)
+    count.eliminate_zeros()
+    n = np.asarray(matrix.sum(axis=0)).ravel()
+    return item_ids, count, n
+
+
+def cosine_similarity(count, n):
+    """
+    scale the co-occurrence matrix: w[u][v] = count[u][v] / sqrt(N[u] * N[v])
+    :param count: csr co-occurrence matrix
+    :param n: array of rating count for every item
+    :return: csr similarity matrix
+    """
+    count = count.tocoo()
+    weights = count.data / np.sqrt(n[count.row] * n[count.col])
+    return sparse.csr_matrix((weights, (count.row, count.col)), shape=count.shape)
+
+
+def csr_to_dict(item_ids, matrix):
+    """
+    :param item_ids: array of movie id for every row/column
+    :param matrix: csr item x item matrix
+    :return: {movie_id: {movie_id: value}}, empty rows are skipped
+    """
+    res = {}
+    indptr, indices, data = matrix.indptr, matrix.indices, matrix.data
+    for row in range(matrix.shape[0]):
+        start, end = indptr[row], indptr[row + 1]
+        if start == end:
+            continue
+        res[int(item_ids[row])] = dict(
+            zip(item_ids[indices[start:end]].tolist(), data[start:end].tolist())
+        )
+    return res
+
+
+def compute_item_similarity(user_ids, movie_ids):
+    """
+    item-based collaborative filtering similarity with sparse matrix products
+    :param user_ids: array of Rating.user_id
+    :param movie_ids: array of Rating.movie_id
+    :return: {movie_id: {movie_id: similarity}}
+    """
+    if len(movie_ids) == 0:
+        return {}
+    item_ids, count, n = compute_cooccurrence(user_ids, movie_ids)
+    return csr_to_dict(item_ids, cosine_similarity(count, n))
+
+
+def top_k_neighbours(item_ids, similarity, k):
+    """
+    prune every row of the similarity matrix to its k most similar items
+    :param item_ids: array of movie id for every row/column
+    :param similarity: csr similarity matrix
+    :param k: count of neighbours to keep
+    :return: {movie_id: [(movie_id, similarity), ...]} sorted by similarity desc
+    """
+    res = {}
+    indptr, indices, data = similarity.indptr, similarity.indices, similarity.data
+    for row in range(similarity.shape[0]):
+        start, end = indptr[row], indptr[row + 1]
+        if start == end:
+            continue
+        weights = data[start:end]
+        if end - start > k:
+            keep = np.argpartition(-weights, k - 1)[:k]
+        else:
+            keep = np.arange(end - start)
+        keep = keep[np.argsort(-weights[keep], kind="stable")]
+        res[int(item_ids[row])] = list(
+            zip(item_ids[indices[start:end][keep]].tolist(), weights[keep].tolist())
+        )
+    return res
+
+
+def rescale_rows(count_rows, n):
+    """
+    recompute the similarity rows of the changed items from the item-cf state
+    :param count_rows: {movie_id: {movie_id: count}} of the changed items
+    :param n: {movie_id: N} of the changed items and their neighbours
+    :return: {movie_id: {movie_id: similarity}}, 0 for pairs no longer co-rated
+    """
+    res = {}
+    for i, row in count_rows.items():
+        res[i] = {
+            j: cij / math.sqrt(n[i] * n[j]) if cij > 0 and n[i] * n[j] > 0 else 0.0
+            for j, cij in row.items()
+        }
+    return res
+
+
+def rank_candidates(owner, neighbour_ids, weights, scores, rated_movie_ids):
+    """
+    item-cf scoring: p[j] = sum of w[i][j] * score[i] over the rated movies i
+    :param owner: index into `scores` of the rated movie of every entry
+    :param neighbour_ids: neighbour movie id of every entry
+    :param weights: similarity of every entry
+    :param scores: rating score of every rated movie
+    :param rated_movie_ids: ids of movies rated by the user, never recommended
+    :return: (movie ids, scores) ranked by score desc
+    """
+    neighbour_ids = np.asarray(neighbour_ids, dtype=np.int64)
+    keep = ~np.isin(neighbour_ids, np.asarray(rated_movie_ids, dtype=np.int64))
+    contribution = (
+        np.asarray(weights, dtype=np.float64)[keep]
+        * np.asarray(scores, dtype=np.float64)[np.asarray(owner, dtype=np.int64)[keep]]
+    )
+    movie_ids, inverse = np.unique(neighbour_ids[keep], return_inverse=True)
+    total = np.bincount(inverse, weights=contribution, minlength=len(movie_ids))
+    order = np.argsort(-total, kind="stable")
+    return movie_ids[order], total[order]
@@ -0,0 +1,245 @@
+"""
+in-process full-text search used when elasticsearch is not configured.
+every index is kept in memory and persisted as a snapshot plus an append-only
+log of changes, processes sharing the directory replay the log before a query
+"""
+import fcntl
+import json
+import math
+import os
+import re
+import threading
+from collections import Counter
+
+# bm25 parameters, the defaults of elasticsearch
+K1 = 1.2
+B = 0.75
+
+# kana, cjk ideographs and hangul
+_CJK = r"\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff"
+_TOKEN_RE = re.compile(r"[%s]+|[^\W_%s]+" % (_CJK, _CJK))
+_CJK_RE = re.compile("[%s]" % _CJK)
+_FILE_NAME_RE = re.compile(r"^(.+)-(\d+)\.(snapshot|log)$")
+
+
+def tokenize(text, query=False):
+    """
+    words are split on non-word characters, runs of cjk characters are split
+    into overlapping bigrams, documents also index their single characters so
+    one-character queries match
+    :param text: str or None
+    :param query: tokenize a query instead of a document
+    :return: list of tokens
+    """
+    if not text:
+        return []
+    tokens = []
+    for run in _TOKEN_RE.findall(str(text).lower()):
+        if not _CJK_RE.match(run):
+            tokens.append(run)
+            continue
+        bigrams = [run[i : i + 2] for i in range(len(run) - 1)]
+        if not query:
+            tokens.extend(run)
+            tokens.extend(bigrams)
+        else:
+            tokens.extend(bigrams or [run])
+    return tokens
+
+
+class LocalSearchIndex:
+    """
+    one index, the documents are {field: value} of `__searchable__` fields
+    """
+
+    def __init__(self, directory, name):
+        self.directory = directory
+        self.name = name
+        self._lock = threading.Lock()
+        self._reset(0)
+
+    def _reset(self, generation):
+        self.generation = generation
+        self._offset = 0
+        self._log_size = 0
+        # {id: {field: value}}, written to the snapshot when compacted
+        self._raw = {}
+        # {id: {field: (length, Counter of tokens)}}
+        self._docs = {}
+        # {field: {token: {id: term frequency}}}
+        self._postings = {}
+        # {field: sum of lengths}
+        self._lengths = Counter()
+
+    def _path(self, generation, kind):
+        return os.path.join(self.directory, "%s-%d.%s" % (self.name, generation, kind))
+
+    def _latest_generation(self):
+        generations = [
+            int(match.group(2))
+            for match in map(_FILE_NAME_RE.match, os.listdir(self.directory))
+            if match and match.group(1) == self.name and match.group(3) == "snapshot"
+        ]
+        return max(generations, default=0)
+
+    def _remove(self, doc_id):
+        self._raw.pop(doc_id, None)
+        doc = self._docs.pop(doc_id, None)
+        if doc is None:
+            return
+        for field, (length, counts) in doc.items():
+            self._lengths[field] -= length
+            postings = self._postings[field]
+            for token in counts:
+                del postings[token][doc_id]
+                if not postings[token]:
+                    del postings[token]
+
+    def _add(self, doc_id, fields):
+        self._remove(doc_id)
+        doc = {}
+        for field, value in fields.items():
+            tokens = tokenize(value)
+            counts = Counter(tokens)
+            doc[field] = (len(tokens), counts)
+            self._lengths[field] += len(tokens)
+            postings = self._postings.setdefault(field, {})
+            for token, count in counts.items():
+                postings.setdefault(token, {})[doc_id] = count
+        self._docs[doc_id] = doc
+        self._raw[doc_id] = fields
+
+    def _apply(self, line):
+        entry = json.loads(line)
+        if entry["op"] == "index":
+            self._add(entry["id"], entry["fields"])
+        else:
+            self._remove(entry["id"])
+
+    def _replay(self, path):
+        """
+        apply the complete lines written after the last replay
+        """
+        with open(path, "rb") as f:
+            f.seek(self._offset)
+            data = f.read()
+        end = data.rfind(b"\n") + 1
+        for line in data[:end].splitlines():
+            self._apply(line)
+            self._log_size += 1
+        self._offset += end
+
+    def _refresh(self):
+        os.makedirs(self.directory, exist_ok=True)
+        while True:
+            generation = self._latest_generation()
+            try:
+                if generation != self.generation:
+                    self._reset(generation)
+                    if generation:
+                        self._replay(self._path(generation, "snapshot"))
+                        self._offset, self._log_size = 0, 0
+                log_path = self._path(generation, "log")
+                if os.path.exists(log_path):
+                    self._replay(log_path)
+                return
+            except FileNotFoundError:
+                # compacted by another process while reading
+                self.generation = -1
+
+    def _compact(self):
+        """
+        write the documents to a new snapshot and start an empty log
+        """
+        generation = self.generation + 1
+        path = self._path(generation, "snapshot")
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w") as f:
+            for doc_id, fields in self._raw.items():
+                f.write(_dumps("index", doc_id, fields))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+        for kind in ("snapshot", "log"):
+            try:
+                os.remove(self._path(self.generation, kind))
+            except FileNotFoundError:
+                pass
+        self.generation = generation
+        self._offset, self._log_size = 0, 0
+
+    def write(self, ops, compact_size=10000):
+        """
+        :param ops: iterable of ("index", id, {field: value}) or ("delete", id, None)
+        :param compact_size: compact when the log has more entries than this
+                             and than the documents
+        :return: count of written ops
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        with self._lock, open(
+            os.path.join(self.directory, self.name + ".lock"), "w"
+        ) as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            self._refresh()
+            count = 0
+            with open(self._path(self.generation, "log"), "a") as f:
+                for op, doc_id, fields in ops:
+                    f.write(_dumps(op, doc_id, fields))
+                    count += 1
+            self._replay(self._path(self.generation, "log"))
+            if self._log_size > max(compact_size, len(self._docs)):
+                self._compact()
+            return count
+
+    def search(self, query, weights, page, per_page):
+        """
+        rank the documents matching any token of `query` by the weighted sum
+        of the bm25 scores of their fields
+        :param query: query string
+        :param weights: {field: weight}
+        :param page: current page
+        :param per_page: records-count/page
+        :return: [ids] of records, total
+        """
+        with self._lock:
+            self._refresh()
+            total_docs = len(self._docs)
+            scores = Counter()
+            for field, weight in weights.items():
+                postings = self._postings.get(field, {})
+                avg_length = self._lengths[field] / total_docs if total_docs else 0
+                for token in set(tokenize(query, query=True)):
+                    matched = postings.get(token)
+                    if not matched:
+                        continue
+                    idf = math.log(
+                        1 + (total_docs - len(matched) + 0.5) / (len(matched) + 0.5)
+                    )
+                    for doc_id, tf in matched.items():
+                        length = self._docs[doc_id][field][0]
+                        norm = K1 * (1 - B + B * length / avg_length)
+                        scores[doc_id] += weight * idf * tf * (K1 + 1) / (tf + norm)
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+        start = (page - 1) * per_page
+        return [doc_id for doc_id, _ in ranked[start : start + per_page]], len(ranked)
+
+
+def _dumps(op, doc_id, fields):
+    return json.dumps({"op": op, "id": doc_id, "fields": fields}) + "\n"
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_local_index(directory, name):
+    """
+    :param directory: directory of the index files
+    :param name: index name
+    :return: LocalSearchIndex shared by the process
+    """
+    with _indexes_lock:
+        key = (directory, name)
+        if key not in _indexes:
+            _indexes[key] = LocalSearchIndex(directory, name)
+        return _indexes[key]
@@ -1,75 +1,106 @@
 import datetime
+import json
 
 from app.const import AccountOperations
 from app.extensions import redis_store
 
 
-def add_rating_to_rank_redis(movie, dec=False):
+# 排行榜滚动窗口的天数
+RANK_WINDOWS = {"week": 7, "month": 30}
+
+
+def _rank_day_key(day):
+    return "rating:" + day.strftime("%y%m%d")
+
+
+def apply_rank_increments(increments):
     """
-    在用户评分时,添加所评价电影到redis zset中 ,并设置过期时间
-    :param movie: Movie
-    :param dec: set True when delete rating
+    评价提交后, 在一个事务中把评价数的变化加到当天的 zset 以及每个滚动窗口的 zset 中
+    :param increments: {movie_id: change of rating count}
     """
-    key = "rating:" + datetime.date.today().strftime("%y%m%d")
-    # 设置过期时间为三十天
-    if dec:
-        redis_store.zincrby(key, -1, str(movie.id))
-    else:
-        redis_store.zincrby(key, 1, str(movie.id))
-    redis_store.expire(key, time=60 * 60 * 24 * 31)
+    increments = {movie_id: delta for movie_id, delta in increments.items() if delta}
+    if not increments:
+        return
+    key = _rank_day_key(datetime.date.today())
+    pipe = redis_store.pipeline()
+    for movie_id, delta in increments.items():
+        pipe.zincrby(key, delta, str(movie_id))
+        for window in RANK_WINDOWS:
+            pipe.zincrby("rating:rank:" + window, delta, str(movie_id))
+    # 设置过期时间为三十一天
+    pipe.expire(key, time=60 * 60 * 24 * 31)
+    pipe.incr("rating:rank:version")
+    pipe.execute()
 
 
-def _movie_rank_redis_zset_paginate(
-    keys, time_range="week", page=1, per_page=20, desc=True, with_scores=False
-):
+def save_rank_days(day_counts):
     """
-    :param keys :redis``key``list
-    :param time_range: such as 'week' or 'month'
-    :param page :需要取出第几页,从1开始计数
-    :param per_page :每页返回的数量
-    :param desc :``True`` 降序排序, ``False`` 升序排序
-    :param with_scores: ``True`` 带分数返回,``False`` 不带分数返回
+    用 ratings 表统计出的评价数替换每天的 zset, 不重建滚动窗口
+    :param day_counts: {datetime.date: {movie_id: rating count}}
     """
-    today_rank_key = (
-        "rating:rank:" + time_range + ":" + datetime.date.today().strftime("%y%m%d")
-    )
-    if not redis_store.exists(today_rank_key):
-        redis_store.zunionstore(today_rank_key, keys=keys)
-        redis_store.expire(today_rank_key, time=60 * 5)  # 排行榜临时键过期时间为五分钟
-
-    start = per_page * (page - 1)
-    end = start + per_page - 1
-    total_count = redis_store.zcard(today_rank_key)
-
-    return (
-        [
-            value.decode()
-            for value in redis_store.zrange(
-                today_rank_key, start=start, end=end, desc=desc, withscores=with_scores
-            )
-            if redis_store.zrange(
-                today_rank_key, start=start, end=end, desc=desc, withscores=with_scores
+    pipe = redis_store.pipeline()
+    for day, counts in day_counts.items():
+        key = _rank_day_key(day)
+        pipe.delete(key)
+        if counts:
+            pipe.zadd(key, {str(movie_id): count for movie_id, count in counts.items()})
+            pipe.expireat(
+                key,
+                datetime.datetime.combine(day, datetime.time())
+                + datetime.timedelta(days=31),
             )
-        ],
-        total_count,
-    )
+    pipe.execute()
+
+
+def rebuild_rank_windows(force=False):
+    """
+    每天一次把每天的 zset 合并成滚动窗口, 移出窗口的那一天随之去掉
+    :param force: rebuild even if the windows are rebuilt today
+    :return: True if rebuilt
+    """
+    today = datetime.date.today()
+    marker = today.strftime("%y%m%d")
+    if not force and redis_store.get("rating:rank:day") == marker.encode():
+        return False
+    pipe = redis_store.pipeline()
+    for window, days in RANK_WINDOWS.items():
+        key = "rating:rank:" + window
+        day_keys = [
+            _rank_day_key(today - datetime.timedelta(days=i)) for i in range(days)
+        ]
+        pipe.zunionstore(key, keys=day_keys)
+        pipe.zremrangebyscore(key, "-inf", 0)
+    pipe.set("rating:rank:day", marker)
+    pipe.incr("rating:rank:version")
+    pipe.execute()
+    return True
 
 
-def get_rank_movie_ids_with_range(days, page=1, per_page=20):
+def get_rank_version():
     """
-    :param days: count of days
+    :return: 排行榜的版本号, 每次写入都会改变
+    """
+    return int(redis_store.get("rating:rank:version") or 0)
+
+
+def get_rank_movie_ids(window, page=1, per_page=20):
+    """
+    :param window: key of `RANK_WINDOWS`
     :param page: current page
     :param per_page: items count of one page
-    :return:
+    :return: ([(movie_id, rating count)] ranked desc, total)
     """
-    today = datetime.datetime.today()
-    keys = [
-        "rating:" + (today - datetime.timedelta(days=days)).strftime("%y%m%d")
-        for days in range(0, days)
-    ]
-    return _movie_rank_redis_zset_paginate(
-        keys=keys, time_range=str(days), page=page, per_page=per_page
-    )
+    key = "rating:rank:" + window
+    # 空的窗口没有 key, 和其他窗口一样每天只重建一次
+    if not redis_store.exists(key):
+        rebuild_rank_windows()
+    start = per_page * (page - 1)
+    pipe = redis_store.pipeline(transaction=False)
+    # 评价被删除的电影在窗口重建前保留为 0
+    pipe.zrevrangebyscore(key, "+inf", 1, start=start, num=per_page, withscores=True)
+    pipe.zcount(key, 1, "+inf")
+    entries, total = pipe.execute()
+    return [(int(movie_id), int(count)) for movie_id, count in entries], total
 
 
 def test_limit_of_send_email(user, operation):
@@ -94,12 +125,533 @@ def test_limit_of_send_email(user, operation):
     return -2
 
 
-def push_task_id_to_redis(key, task_id):
-    redis_store.rpush(key, task_id)
+def apply_similarity_deltas(deltas):
+    """
+    评价提交后, 在一个事务中更新 item-cf 的共现计数 count[i][j] 和物品计数 N[i],
+    并标记这些用户的推荐列表需要刷新
+    :param deltas: [(user_id, movie_id, ids of other movies rated by the user,
+                   1 when rate or -1 when delete rating)]
+    """
+    if not deltas:
+        return
+
+    def apply(pipe):
+        rebuilding = pipe.exists("item-cf:rebuilding")
+        pipe.multi()
+        if rebuilding:
+            # 由 `finish_similarity_rebuild` 应用到新的计数上
+            pipe.rpush(
+                "item-cf:journal",
+                *[
+                    json.dumps([user_id, rated_id, list(rated_ids), step])
+                    for user_id, rated_id, rated_ids, step in deltas
+                ]
+            )
+            return
+        _incr_similarity_state(pipe, deltas)
+
+    redis_store.transaction(apply, "item-cf:rebuilding")
+
+
+def _incr_similarity_state(pipe, deltas):
+    for user_id, rated_id, rated_movie_ids, step in deltas:
+        pipe.hincrby("item-cf:n", rated_id, step)
+        for movie_id in rated_movie_ids:
+            pipe.hincrby("item-cf:count:" + str(rated_id), movie_id, step)
+            pipe.hincrby("item-cf:count:" + str(movie_id), rated_id, step)
+        pipe.sadd("item-cf:dirty", rated_id)
+        pipe.sadd("recommend:dirty-users", user_id)
+
+
+def start_similarity_rebuild(expire=60 * 60):
+    """
+    全量重建读取评价之前调用, 此后提交的变化先记到日志中, 不直接应用
+    :param expire: seconds before an unfinished rebuild stops the journal
+    """
+    pipe = redis_store.pipeline()
+    pipe.delete("item-cf:journal")
+    pipe.set("item-cf:rebuilding", 1, ex=expire)
+    pipe.execute()
+
+
+def finish_similarity_rebuild():
+    """
+    把重建期间提交的变化应用到新的计数上, 这些电影和其他评价一样被标记为需要更新
+    """
+    pipe = redis_store.pipeline()
+    pipe.lrange("item-cf:journal", 0, -1)
+    pipe.delete("item-cf:journal", "item-cf:rebuilding")
+    entries, _ = pipe.execute()
+    if entries:
+        pipe = redis_store.pipeline()
+        _incr_similarity_state(pipe, [json.loads(entry) for entry in entries])
+        pipe.execute()
+
+
+def save_similarity_state(count_rows, n, chunk_size=1000):
+    """
+    全量重建后替换 item-cf 的计数, 分批写入临时 key 再 rename, 避免一个大事务阻塞 redis
+    :param count_rows: {movie_id: {movie_id: count}}
+    :param n: {movie_id: count of users rated this movie}
+    :param chunk_size: movies written per pipeline
+    """
+    stale = set(redis_store.scan_iter("item-cf:count:*"))
+    movie_ids = list(count_rows.keys())
+    for start in range(0, len(movie_ids), chunk_size):
+        pipe = redis_store.pipeline(transaction=False)
+        for movie_id in movie_ids[start : start + chunk_size]:
+            key = "item-cf:rebuild:count:" + str(movie_id)
+            pipe.delete(key)
+            pipe.hmset(key, count_rows[movie_id])
+        pipe.execute()
+    n_items = list(n.items())
+    redis_store.delete("item-cf:rebuild:n")
+    for start in range(0, len(n_items), chunk_size):
+        redis_store.hmset(
+            "item-cf:rebuild:n", dict(n_items[start : start + chunk_size])
+        )
+    for start in range(0, len(movie_ids), chunk_size):
+        pipe = redis_store.pipeline(transaction=False)
+        for movie_id in movie_ids[start : start + chunk_size]:
+            key = "item-cf:count:" + str(movie_id)
+            stale.discard(key.encode())
+            pipe.rename("item-cf:rebuild:count:" + str(movie_id), key)
+        pipe.execute()
+    if n_items:
+        redis_store.rename("item-cf:rebuild:n", "item-cf:n")
+    else:
+        stale.add(b"item-cf:n")
+    if stale:
+        redis_store.delete(*stale)
+
+
+def pop_dirty_similarity_items():
+    """
+    :return: 上次调用以来评价数变化的电影 id
+    """
+    pipe = redis_store.pipeline()
+    pipe.smembers("item-cf:dirty")
+    pipe.delete("item-cf:dirty")
+    members, _ = pipe.execute()
+    return [value.decode() for value in members]
+
+
+def mark_dirty_similarity_items(movie_ids):
+    """
+    :param movie_ids: 下次 `update_item_similarity` 需要重新计算的电影 id
+    """
+    if movie_ids:
+        redis_store.sadd("item-cf:dirty", *movie_ids)
+
+
+def get_similarity_state(movie_ids):
+    """
+    :param movie_ids: ids of changed movies
+    :return: count rows of `movie_ids`, N of `movie_ids` and their neighbours
+    """
+    pipe = redis_store.pipeline()
+    for movie_id in movie_ids:
+        pipe.hgetall("item-cf:count:" + str(movie_id))
+    count_rows = {
+        movie_id: {key.decode(): int(value) for key, value in row.items()}
+        for movie_id, row in zip(movie_ids, pipe.execute())
+    }
+    needed = set(movie_ids)
+    for row in count_rows.values():
+        needed.update(row.keys())
+    needed = list(needed)
+    n = {
+        movie_id: int(value) if value else 0
+        for movie_id, value in zip(needed, redis_store.hmget("item-cf:n", needed))
+    }
+    return count_rows, n
+
+
+def save_item_neighbours(neighbours, chunk_size=1000):
+    """
+    全量重建后替换每部电影的 top-K 相似电影 zset
+    :param neighbours: {movie_id: [(movie_id, similarity), ...]}
+    :param chunk_size: movies written per pipeline
+    """
+    stale = set(redis_store.scan_iter("item-cf:neighbours:*"))
+    movie_ids = list(neighbours.keys())
+    for start in range(0, len(movie_ids), chunk_size):
+        pipe = redis_store.pipeline(transaction=False)
+        for movie_id in movie_ids[start : start + chunk_size]:
+            key = "item-cf:neighbours:" + str(movie_id)
+            stale.discard(key.encode())
+            pipe.delete(key)
+            pipe.zadd(key, dict(neighbours[movie_id]))
+        pipe.execute()
+    if stale:
+        redis_store.delete(*stale)
+
+
+def patch_item_neighbours(rows, k):
+    """
+    重写变化电影的相似电影 zset, 并修改它们在相似电影的 zset 中的分数,
+    后者在下次全量重建前是近似值
+    :param rows: {movie_id: {movie_id: similarity}} of the changed movies
+    :param k: count of neighbours kept per movie
+    """
+    pipe = redis_store.pipeline()
+    for i, row in rows.items():
+        key = "item-cf:neighbours:" + str(i)
+        top = sorted(
+            ((j, w) for j, w in row.items() if w > 0),
+            key=lambda item: item[1],
+            reverse=True,
+        )[0:k]
+        pipe.delete(key)
+        if top:
+            pipe.zadd(key, dict(top))
+        for j, w in row.items():
+            neighbour_key = "item-cf:neighbours:" + str(j)
+            if w > 0:
+                pipe.zadd(neighbour_key, {i: w})
+                pipe.zremrangebyrank(neighbour_key, 0, -(k + 1))
+            else:
+                pipe.zrem(neighbour_key, i)
+    pipe.execute()
+
+
+def get_item_neighbours(movie_ids, k):
+    """
+    :param movie_ids: ids of movies rated by the user
+    :param k: count of most similar movies returned for every movie
+    :return: {movie_id: [(movie_id, similarity), ...]} sorted by similarity desc
+    """
+    pipe = redis_store.pipeline(transaction=False)
+    for movie_id in movie_ids:
+        pipe.zrevrange("item-cf:neighbours:" + str(movie_id), 0, k - 1, withscores=True)
+    return {
+        movie_id: [(int(value), score) for value, score in row]
+        for movie_id, row in zip(movie_ids, pipe.execute())
+    }
 
 
-def get_task_id_from_redis(key):
-    key_len = redis_store.llen(key)
-    if key_len > 0:
-        return redis_store.lrange(key, key_len - 1, key_len)[-1]
-    return None
+def next_similarity_snapshot_version():
+    return redis_store.incr("item-cf:snapshot:next-version")
+
+
+def publish_similarity_snapshot(version):
+    """
+    web worker 下次检查时切换到这个版本的快照
+    :param version: snapshot version
+    """
+    redis_store.set("item-cf:snapshot:version", version)
+
+
+def similarity_snapshot_lock(timeout):
+    """
+    全量重建或拼接、发布快照时持有, 避免拼接的快照被另一个任务删除
+    :param timeout: worker 异常退出时锁自动释放的秒数
+    :return: redis lock
+    """
+    return redis_store.lock("item-cf:snapshot-lock", timeout=timeout)
+
+
+def get_similarity_snapshot_version():
+    """
+    :return: 最新发布的快照版本或 None
+    """
+    version = redis_store.get("item-cf:snapshot:version")
+    return int(version) if version else None
+
+
+def pop_dirty_recommendation_users():
+    """
+    :return: 上次调用以来评价或删除评价的用户 id
+    """
+    pipe = redis_store.pipeline()
+    pipe.smembers("recommend:dirty-users")
+    pipe.delete("recommend:dirty-users")
+    members, _ = pipe.execute()
+    return [int(value) for value in members]
+
+
+def save_user_recommendations(user_id, movie_ids, scores, expire):
+    """
+    :param user_id: User.id
+    :param movie_ids: recommended movie ids
+    :param scores: score of every recommended movie
+    :param expire: seconds the list is kept if the user is not refreshed
+    """
+    key = "recommend:user:" + str(user_id)
+    pipe = redis_store.pipeline()
+    pipe.delete(key)
+    if movie_ids:
+        pipe.zadd(key, dict(zip(movie_ids, scores)))
+        pipe.expire(key, time=expire)
+    pipe.execute()
+
+
+def get_user_recommendations(user_id, page=1, per_page=20):
+    """
+    :param user_id: User.id
+    :param page: current page
+    :param per_page: items count of one page
+    :return: (movie ids ranked by score desc, total)
+    """
+    key = "recommend:user:" + str(user_id)
+    start = per_page * (page - 1)
+    pipe = redis_store.pipeline(transaction=False)
+    pipe.zrevrange(key, start, start + per_page - 1)
+    pipe.zcard(key)
+    movie_ids, total = pipe.execute()
+    return [int(value) for value in movie_ids], total
+
+
+def add_endpoint_stats(endpoint, stats):
+    """
+    累加一次请求的性能计数
+    :param endpoint: request.endpoint
+    :param stats: {name: value}, values of names end with `_time` are seconds
+    """
+    key = "perf:endpoint:" + endpoint
+    pipe = redis_store.pipeline(transaction=False)
+    pipe.sadd("perf:endpoints", endpoint)
+    pipe.hincrby(key, "requests", 1)
+    for name, value in stats.items():
+        if name.endswith("_time"):
+            pipe.hincrby(key, name + "_us", int(value * 1000000))
+        else:
+            pipe.hincrby(key, name, value)
+    pipe.execute()
+
+
+def get_endpoint_stats():
+    """
+    :return: {endpoint: {name: total}}
+    """
+    endpoints = sorted(
+        value.decode() for value in redis_store.smembers("perf:endpoints")
+    )
+    pipe = redis_store.pipeline(transaction=False)
+    for endpoint in endpoints:
+        pipe.hgetall("perf:endpoint:" + endpoint)
+    return {
+        endpoint: {name.decode(): int(value) for name, value in stats.items()}
+        for endpoint, stats in zip(endpoints, pipe.execute())
+    }
+
+
+def clear_endpoint_stats():
+    endpoints = [value.decode() for value in redis_store.smembers("perf:endpoints")]
+    redis_store.delete(
+        "perf:endpoints", *["perf:endpoint:" + endpoint for endpoint in endpoints]
+    )
+
+
+def save_auth_snapshot(user_id, snapshot, expire):
+    """
+    :param user_id: User.id
+    :param snapshot: dict of columns of the user, json serializable
+    :param expire: seconds
+    """
+    redis_store.set("auth:user:" + str(user_id), json.dumps(snapshot), ex=expire)
+
+
+def get_auth_snapshot(user_id):
+    """
+    :param user_id: User.id
+    :return: dict saved by `save_auth_snapshot` or None
+    """
+    value = redis_store.get("auth:user:" + str(user_id))
+    if value is None:
+        return None
+    return json.loads(value.decode())
+
+
+def delete_auth_snapshots(user_ids):
+    """
+    :param user_ids: list of User.id
+    """
+    if user_ids:
+        redis_store.delete(*["auth:user:" + str(user_id) for user_id in user_ids])
+
+
+def timeline_score(created_at):
+    """
+    :param created_at: Rating.created_at, naive utc datetime
+    :return: score of the rating in timelines
+    """
+    return created_at.replace(tzinfo=datetime.timezone.utc).timestamp()
+
+
+# 每个已填充的时间线中都保留这个成员, 没有评价的时间线也不会被当作不存在
+_TIMELINE_SENTINEL = "0:0"
+
+
+def _timeline_member(rating_id, author_id):
+    return "{}:{}".format(rating_id, author_id)
+
+
+def _timeline_mapping(items):
+    return {
+        _timeline_member(rating_id, author_id): timeline_score(created_at)
+        for rating_id, author_id, created_at in items
+    }
+
+
+def save_timeline(user_id, items, size, expire):
+    """
+    填充一个用户的时间线, 与已推送的评价合并
+    :param user_id: User.id
+    :param items: [(rating_id, author_id, created_at)]
+    :param size: max count of ratings kept in one timeline
+    :param expire: seconds the timeline is kept if it is not read
+    """
+    key = "timeline:" + str(user_id)
+    mapping = _timeline_mapping(items)
+    # 分数最低, 时间线满后最先被截掉
+    mapping[_TIMELINE_SENTINEL] = 0
+    pipe = redis_store.pipeline()
+    pipe.zadd(key, mapping)
+    pipe.zremrangebyrank(key, 0, -size - 1)
+    pipe.expire(key, time=expire)
+    pipe.execute()
+
+
+def push_to_timelines(user_ids, items, size):
+    """
+    把评价推送到关注者的时间线, 未填充(或已过期)的时间线跳过, 读取时再从 mysql 填充
+    :param user_ids: ids of the followers
+    :param items: [(rating_id, author_id, created_at)]
+    :param size: max count of ratings kept in one timeline
+    """
+    keys = ["timeline:" + str(user_id) for user_id in user_ids]
+    pipe = redis_store.pipeline(transaction=False)
+    for key in keys:
+        pipe.exists(key)
+    keys = [key for key, exists in zip(keys, pipe.execute()) if exists]
+    if not keys or not items:
+        return
+    mapping = _timeline_mapping(items)
+    pipe = redis_store.pipeline(transaction=False)
+    for key in keys:
+        pipe.zadd(key, mapping)
+        pipe.zremrangebyrank(key, 0, -size - 1)
+    pipe.execute()
+
+
+def remove_from_timelines(user_ids, rating_ids, author_id):
+    """
+    :param user_ids: ids of the followers
+    :param rating_ids: ids of the deleted ratings
+    :param author_id: Rating.user_id
+    """
+    members = [_timeline_member(rating_id, author_id) for rating_id in rating_ids]
+    pipe = redis_store.pipeline(transaction=False)
+    for user_id in user_ids:
+        pipe.zrem("timeline:" + str(user_id), *members)
+    pipe.execute()
+
+
+def remove_author_from_timeline(user_id, author_id):
+    """
+    取消关注后从时间线中删除该用户的评价
+    :param user_id: User.id of the timeline
+    :param author_id: User.id of the unfollowed user
+    """
+    key = "timeline:" + str(user_id)
+    suffix = ":" + str(author_id)
+    members = [
+        member
+        for member in redis_store.zrange(key, 0, -1)
+        if member.decode().endswith(suffix)
+    ]
+    if members:
+        redis_store.zrem(key, *members)
+
+
+def get_timeline(user_id, count, expire):
+    """
+    :param user_id: User.id
+    :param count: count of the newest ratings to return
+    :param expire: seconds the timeline is kept from now on
+    :return: ([(rating_id, author_id, timestamp)] newest first, total), total is
+             None if the timeline is not filled
+    """
+    key = "timeline:" + str(user_id)
+    pipe = redis_store.pipeline(transaction=False)
+    pipe.zrevrange(key, 0, count - 1, withscores=True)
+    pipe.zcard(key)
+    pipe.zscore(key, _TIMELINE_SENTINEL)
+    pipe.expire(key, time=expire)
+    entries, total, sentinel, _ = pipe.execute()
+    if not total:
+        return [], None
+    res = []
+    for member, timestamp in entries:
+        member = member.decode()
+        if member == _TIMELINE_SENTINEL:
+            continue
+        rating_id, author_id = member.split(":")
+        res.append((int(rating_id), int(author_id), timestamp))
+    return res, total - (sentinel is not None)
+
+
+def set_feed_celebrity(user_id, celebrity):
+    """
+    :param user_id: User.id
+    :param celebrity: True if his ratings are not fanned out to the followers
+    :return: True if the state of the user changed
+    """
+    if celebrity:
+        return bool(redis_store.sadd("feed:celebrities", user_id))
+    return bool(redis_store.srem("feed:celebrities", user_id))
+
+
+def get_feed_celebrities():
+    return {int(user_id) for user_id in redis_store.smembers("feed:celebrities")}
+
+
+def get_cached_count(key):
+    """
+    :param key: signature of the counted query
+    :return: int or None
+    """
+    value = redis_store.get("count:" + key)
+    return int(value) if value is not None else None
+
+
+def save_cached_count(key, count, expire):
+    redis_store.set("count:" + key, count, ex=expire)
+
+
+def add_to_search_outbox(changes):
+    """
+    记录可搜索模型已提交的变化, 同一文档后来的变化覆盖之前的
+    :param changes: {index: {id: "index" or "delete"}}
+    """
+    pipe = redis_store.pipeline()
+    for index, ops in changes.items():
+        if ops:
+            pipe.hmset("search:outbox:" + index, ops)
+    pipe.execute()
+
+
+def pop_search_outbox(index):
+    """
+    :param index: es index
+    :return: {id: "index" or "delete"} queued since last call
+    """
+    key = "search:outbox:" + index
+    pipe = redis_store.pipeline()
+    pipe.hgetall(key)
+    pipe.delete(key)
+    ops, _ = pipe.execute()
+    return {int(model_id): op.decode() for model_id, op in ops.items()}
+
+
+def requeue_search_outbox(index, ops):
+    """
+    放回同步失败的变化, 文档之后又有变化时不覆盖
+    :param index: es index
+    :param ops: {id: "index" or "delete"}
+    """
+    pipe = redis_store.pipeline()
+    for model_id, op in ops.items():
+        pipe.hsetnx("search:outbox:" + index, model_id, op)
+    pipe.execute()
@@ -0,0 +1,176 @@
+import mmap
+import os
+import re
+import struct
+
+import numpy as np
+
+# magic, count of movies, count of neighbours, version
+_HEADER = struct.Struct("<4sIQQ")
+_HEADER_SIZE = 32
+_MAGIC = b"ICF1"
+_FILE_NAME = "item-cf-{version}.snapshot"
+_FILE_NAME_RE = re.compile(r"^item-cf-(\d+)\.snapshot$")
+
+
+def snapshot_path(directory, version):
+    return os.path.join(directory, _FILE_NAME.format(version=version))
+
+
+def _gather_index(starts, lengths):
+    """
+    :param starts: start of every row in the flat arrays
+    :param lengths: count of entries taken from every row
+    :return: positions of the taken entries, row by row
+    """
+    return np.arange(lengths.sum()) + np.repeat(
+        starts - np.cumsum(lengths) + lengths, lengths
+    )
+
+
+def snapshot_arrays(neighbours):
+    """
+    :param neighbours: {movie_id: [(movie_id, similarity), ...]} sorted desc
+    :return: (movie ids, row offsets, neighbour ids, weights)
+    """
+    item_ids = np.array(sorted(neighbours.keys()), dtype=np.int64)
+    rows = [neighbours[movie_id] for movie_id in item_ids.tolist()]
+    offsets = np.zeros(len(rows) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(row) for row in rows])
+    neighbour_ids = np.array([j for row in rows for j, _ in row], dtype=np.int32)
+    weights = np.array([w for row in rows for _, w in row], dtype=np.float32)
+    return item_ids, offsets, neighbour_ids, weights
+
+
+def write_snapshot_arrays(directory, version, arrays):
+    """
+    write the top-K neighbours as a read-only CSR-style binary file:
+    header, movie ids, row offsets, neighbour ids and float32 weights.
+    the file is written aside and renamed, readers never see a partial file
+    :param directory: snapshot directory
+    :param version: snapshot version
+    :param arrays: (movie ids, row offsets, neighbour ids, weights)
+    :return: path of the snapshot
+    """
+    item_ids, offsets, neighbour_ids, weights = arrays
+    os.makedirs(directory, exist_ok=True)
+    path = snapshot_path(directory, version)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(
+            _HEADER.pack(_MAGIC, len(item_ids), len(neighbour_ids), version).ljust(
+                _HEADER_SIZE, b"\0"
+            )
+        )
+        f.write(item_ids.astype(np.int64).tobytes())
+        f.write(offsets.astype(np.int64).tobytes())
+        f.write(neighbour_ids.astype(np.int32).tobytes())
+        f.write(weights.astype(np.float32).tobytes())
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    return path
+
+
+def splice_rows(snapshot, rows):
+    """
+    replace the rows of some movies, the other rows are copied from the
+    mapped arrays without going through python objects
+    :param snapshot: SimilaritySnapshot
+    :param rows: {movie_id: [(movie_id, similarity), ...]}, an empty row drops
+                 the movie
+    :return: (movie ids, row offsets, neighbour ids, weights)
+    """
+    changed = np.array(sorted(rows), dtype=np.int64)
+    keep = ~np.isin(snapshot.item_ids, changed)
+    kept_lengths = np.diff(snapshot.offsets)[keep]
+    kept = _gather_index(snapshot.offsets[:-1][keep], kept_lengths)
+    new_ids, new_offsets, new_neighbour_ids, new_weights = snapshot_arrays(
+        {movie_id: row for movie_id, row in rows.items() if row}
+    )
+    item_ids = np.concatenate([snapshot.item_ids[keep], new_ids])
+    lengths = np.concatenate([kept_lengths, np.diff(new_offsets)])
+    neighbour_ids = np.concatenate([snapshot.neighbour_ids[kept], new_neighbour_ids])
+    weights = np.concatenate([snapshot.weights[kept], new_weights])
+    # rows are sorted by movie id, `SimilaritySnapshot.rows` searches them
+    order = np.argsort(item_ids, kind="stable")
+    starts = np.cumsum(lengths) - lengths
+    index = _gather_index(starts[order], lengths[order])
+    offsets = np.zeros(len(item_ids) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum(lengths[order])
+    return item_ids[order], offsets, neighbour_ids[index], weights[index]
+
+
+def remove_old_snapshots(directory, keep=2):
+    """
+    remove all but the newest `keep` snapshots, processes which still map
+    a removed file keep reading it until they swap
+    :param directory: snapshot directory
+    :param keep: count of snapshots to keep
+    """
+    versions = sorted(
+        int(match.group(1))
+        for match in map(_FILE_NAME_RE.match, os.listdir(directory))
+        if match
+    )
+    for version in versions[:-keep]:
+        try:
+            os.remove(snapshot_path(directory, version))
+        except FileNotFoundError:
+            pass
+
+
+class SimilaritySnapshot:
+    """
+    memory-mapped top-K neighbours, the pages are shared by every process
+    mapping the same file
+    """
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, n, nnz, self.version = _HEADER.unpack_from(self._mmap, 0)
+        if magic != _MAGIC:
+            raise ValueError("%s is not an item-cf snapshot" % path)
+        offset = _HEADER_SIZE
+        self.item_ids = np.frombuffer(self._mmap, np.int64, n, offset)
+        offset += self.item_ids.nbytes
+        self.offsets = np.frombuffer(self._mmap, np.int64, n + 1, offset)
+        offset += self.offsets.nbytes
+        self.neighbour_ids = np.frombuffer(self._mmap, np.int32, nnz, offset)
+        offset += self.neighbour_ids.nbytes
+        self.weights = np.frombuffer(self._mmap, np.float32, nnz, offset)
+
+    def __len__(self):
+        return len(self.item_ids)
+
+    def rows(self, movie_ids):
+        """
+        :param movie_ids: movie ids
+        :return: row index of every movie, -1 for movies without neighbours
+        """
+        movie_ids = np.asarray(movie_ids, dtype=np.int64)
+        pos = np.searchsorted(self.item_ids, movie_ids)
+        pos[pos >= len(self.item_ids)] = 0
+        found = len(self.item_ids) > 0
+        if found:
+            found = self.item_ids[pos] == movie_ids
+        return np.where(found, pos, -1)
+
+    def gather(self, movie_ids, k):
+        """
+        gather the top-K neighbours of many movies as flat arrays
+        :param movie_ids: movie ids
+        :param k: count of most similar movies gathered for every movie
+        :return: (index into `movie_ids` of every entry, neighbour ids, weights)
+        """
+        rows = self.rows(movie_ids)
+        found = np.flatnonzero(rows >= 0)
+        starts = self.offsets[rows[found]]
+        lengths = np.minimum(self.offsets[rows[found] + 1] - starts, k)
+        index = _gather_index(starts, lengths)
+        return (
+            np.repeat(found, lengths),
+            self.neighbour_ids[index],
+            self.weights[index],
+        )
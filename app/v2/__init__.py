@@ -17,6 +17,7 @@ from app.v2.movie import (
 from app.v2.notification import Notification, NotificationCount
 from app.v2.rating import Rating, ReportedRating
 from app.v2.search import Search
+from app.v2.stats import EndpointStats
 from app.v2.tag import Country, Genre, Year
 from app.v2.user import (
     AuthToken,
@@ -102,3 +103,5 @@ api.add_resource(
 )
 
 api.add_resource(Photo, "/photo/<image_hash_id>", endpoint="Photo")
+
+api.add_resource(EndpointStats, "/stats/endpoints", endpoint="EndpointStats")
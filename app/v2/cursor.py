@@ -0,0 +1,112 @@
+"""
+keyset pagination: the next page is read by a seek predicate on the ordering
+columns instead of OFFSET, and the total is not counted
+"""
+from datetime import datetime, timedelta
+
+from sqlalchemy import and_, or_
+from sqlalchemy.types import DateTime
+
+from app.utils.hashid import decode_str_to_ids, encode_ids_to_str
+
+_EPOCH = datetime(1970, 1, 1)
+
+
+class CursorPagination:
+    def __init__(self, items, per_page, prev_cursor=None, next_cursor=None):
+        self.items = items
+        self.per_page = per_page
+        self.prev_cursor = prev_cursor
+        self.next_cursor = next_cursor
+
+    @property
+    def has_prev(self):
+        return self.prev_cursor is not None
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+
+def cursor(value):
+    """
+    type of the `after`/`before` arguments
+    :param value: cursor string
+    :return: tuple of int
+    """
+    values = decode_str_to_ids(value)
+    if not values:
+        raise ValueError("invalid cursor")
+    return values
+
+
+def _to_int(value):
+    if isinstance(value, datetime):
+        delta = value - _EPOCH
+        return (delta.days * 86400 + delta.seconds) * 10 ** 6 + delta.microseconds
+    return value
+
+
+def _from_int(column, value):
+    if isinstance(column.type, DateTime):
+        return _EPOCH + timedelta(microseconds=value)
+    return value
+
+
+def _encode(values):
+    return encode_ids_to_str([_to_int(value) for value in values])
+
+
+def _seek(columns, values, newer):
+    """
+    (c1, c2, ...) > values if `newer` else (c1, c2, ...) < values, expanded
+    into OR of ANDs which mysql can range scan on the index
+    """
+    clauses = []
+    for i, column in enumerate(columns):
+        clauses.append(
+            and_(
+                *[c == value for c, value in zip(columns[:i], values[:i])],
+                column > values[i] if newer else column < values[i]
+            )
+        )
+    return or_(*clauses)
+
+
+def cursor_paginate(query, columns, per_page, after=None, before=None):
+    """
+    :param query: query of the items, its ORDER BY is replaced
+    :param columns: ordering columns, the items are listed by them desc, and
+                    the last one must be unique, e.g. (created_at, id)
+    :param per_page: items count of one page
+    :param after: decoded cursor, read the items listed after it
+    :param before: decoded cursor, read the items listed before it
+    :return: CursorPagination
+    """
+    edge = before if before is not None else after
+    if edge is not None and len(edge) != len(columns):
+        return CursorPagination([], per_page)
+    query = query.add_columns(*columns).order_by(None)
+    if before is not None:
+        values = [_from_int(c, value) for c, value in zip(columns, before)]
+        rows = (
+            query.filter(_seek(columns, values, newer=True))
+            .order_by(*[c.asc() for c in columns])
+            .limit(per_page + 1)
+            .all()
+        )
+        has_prev, has_next = len(rows) > per_page, True
+        rows = rows[:per_page][::-1]
+    else:
+        if after is not None:
+            values = [_from_int(c, value) for c, value in zip(columns, after)]
+            query = query.filter(_seek(columns, values, newer=False))
+        rows = query.order_by(*[c.desc() for c in columns]).limit(per_page + 1).all()
+        has_prev, has_next = after is not None, len(rows) > per_page
+        rows = rows[:per_page]
+    return CursorPagination(
+        [row[0] for row in rows],
+        per_page,
+        prev_cursor=_encode(rows[0][1:]) if rows and has_prev else None,
+        next_cursor=_encode(rows[-1][1:]) if rows and has_next else None,
+    )
@@ -1,20 +1,34 @@
-from flask import g
+from flask import current_app, g
 from flask_restful import Resource, inputs, marshal, reqparse
 from flask_sqlalchemy import Pagination
-from sqlalchemy import desc
-from sqlalchemy.sql import func
+from sqlalchemy.orm import contains_eager
 from sqlalchemy.exc import IntegrityError
 from werkzeug.datastructures import FileStorage
 
 from app.const import MovieCinemaStatus, RatingType
 from app.extensions import cache, sql_db
+from app.feed import follow_feed_query, get_follow_feed
 from app.sql_models import Celebrity, Country, Genre, Image
 from app.sql_models import Movie as MovieModel
-from app.sql_models import Rating, User, rating_likes
+from app.sql_models import MovieScore, Rating, User
 from app.utils.auth_decorator import auth, permission_required
 from app.utils.hashid import decode_str_to_id
-from app.utils.redis_utils import get_rank_movie_ids_with_range
-from app.recommender import item_cf_recommendation
+from app.utils.redis_utils import (
+    get_rank_movie_ids,
+    get_rank_version,
+    get_user_recommendations,
+)
+from app.v2.pagination import (
+    add_paging_arguments,
+    is_cursor_paging,
+    paginate,
+    paginate_query,
+)
+from app.v2.prefetch import (
+    load_movies_in_order,
+    prefetch_ratings,
+    prefetch_ratings_with_movie,
+)
 from app.v2.responses import (
     ErrorCode,
     error,
@@ -73,43 +87,25 @@ class MovieRecommend(Resource):
             "per_page", default=20, type=inputs.positive, location="args"
         )
         args = parser.parse_args()
-        recommend_movies_id = item_cf_recommendation(g.current_user.id, 10)
-        if (
-            Rating.query.filter_by(user_id=g.current_user.id).count() < 10
-            or not recommend_movies_id
-        ):
-            score_stmt = (
-                sql_db.session.query(
-                    Rating.movie_id.label("movie_id"),
-                    func.avg(Rating.score).label("avg_score"),
-                )
-                .filter(Rating.category == RatingType.COLLECT)
-                .group_by(Rating.movie_id)
-                .order_by(desc("avg_score"))
-                .subquery()
-            )
+        page_ids, total = get_user_recommendations(
+            g.current_user.id, args.page, args.per_page
+        )
+        if not total:
             watched_movies_id = [
                 rating.movie_id
                 for rating in Rating.query.filter_by(user_id=g.current_user.id)
             ]
             pagination = (
                 sql_db.session.query(MovieModel)
-                .outerjoin(score_stmt, MovieModel.id == score_stmt.c.movie_id)
+                .outerjoin(MovieScore, MovieModel.id == MovieScore.movie_id)
+                .options(contains_eager(MovieModel.score_info))
                 .filter(~MovieModel.id.in_(watched_movies_id))
-                .order_by(score_stmt.c.avg_score.desc())
+                .order_by(MovieScore.score.desc())
                 .paginate(args.page, args.per_page)
             )
         else:
-            movies = MovieModel.query.filter(
-                MovieModel.id.in_(
-                    recommend_movies_id[
-                        (args.page - 1) * args.per_page : args.page * args.per_page
-                    ]
-                )
-            )
-            pagination = Pagination(
-                "", args.page, args.per_page, len(recommend_movies_id), movies
-            )
+            movies = load_movies_in_order(page_ids)
+            pagination = Pagination("", args.page, args.per_page, total, movies)
         p = get_item_pagination(pagination, "api.MovieRecommend")
         return ok(
             "ok",
@@ -121,7 +117,6 @@ class MovieRecommend(Resource):
 
 class LeaderBoard(Resource):
     @auth.login_required
-    @cache.cached(timeout=60, query_string=True)
     def get(self, time_range):
         if time_range not in ["week", "month"]:
             return error(ErrorCode.INVALID_PARAMS, 400)
@@ -131,20 +126,25 @@ class LeaderBoard(Resource):
             "per_page", default=20, type=inputs.positive, location="args"
         )
         args = parser.parse_args()
-        if time_range == "week":
-            days = 7
-        else:
-            days = 30
-        movie_ids, total = get_rank_movie_ids_with_range(days, args.page, args.per_page)
-        movies = MovieModel.query.filter(MovieModel.id.in_(movie_ids)).all()
-        pagination = Pagination("", args.page, args.per_page, total, movies)
-        p = get_item_pagination(pagination, "api.LeaderBoard", time_range=time_range)
-        return ok(
-            "ok",
-            data=marshal(
+        # the page is cached until any rating changes the leaderboards
+        cache_key = "leaderboard:{}:{}:{}:{}".format(
+            time_range, get_rank_version(), args.page, args.per_page
+        )
+        data = cache.get(cache_key)
+        if data is None:
+            entries, total = get_rank_movie_ids(time_range, args.page, args.per_page)
+            movies = load_movies_in_order([movie_id for movie_id, _ in entries])
+            pagination = Pagination("", args.page, args.per_page, total, movies)
+            p = get_item_pagination(
+                pagination, "api.LeaderBoard", time_range=time_range
+            )
+            data = marshal(
                 p, get_pagination_resource_fields(movie_summary_resource_fields)
-            ),
-        )
+            )
+            cache.set(
+                cache_key, data, timeout=current_app.config["LEADERBOARD_CACHE_TIMEOUT"]
+            )
+        return ok("ok", data=data)
 
 
 class MovieGenresRank(Resource):
@@ -161,22 +161,13 @@ class MovieGenresRank(Resource):
         genre = Genre.query.get(genre_id)
         if not genre:
             return error(ErrorCode.GENRES_NOT_FOUND, 404)
-        score_stmt = (
-            sql_db.session.query(
-                Rating.movie_id.label("movie_id"),
-                func.avg(Rating.score).label("avg_score"),
-            )
-            .filter(Rating.category == RatingType.COLLECT)
-            .group_by(Rating.movie_id)
-            .order_by(desc("avg_score"))
-            .subquery()
-        )
         movies = MovieModel.query.filter(MovieModel.genres.contains(genre)).subquery()
         pagination = (
             sql_db.session.query(MovieModel)
-            .outerjoin(score_stmt, MovieModel.id == score_stmt.c.movie_id)
+            .outerjoin(MovieScore, MovieModel.id == MovieScore.movie_id)
+            .options(contains_eager(MovieModel.score_info))
             .filter(MovieModel.id == movies.c.id)
-            .order_by(score_stmt.c.avg_score.desc())
+            .order_by(MovieScore.score.desc())
             .paginate(args.page, args.per_page)
         )
         p = get_item_pagination(
@@ -219,6 +210,7 @@ class UserMovie(Resource):
                 rating_paginate = this_user.ratings.filter(
                     Rating.category == RatingType.COLLECT
                 ).paginate(args.page, args.per_page)
+            prefetch_ratings_with_movie(rating_paginate.items, g.current_user)
             p = get_item_pagination(rating_paginate, "api.UserMovie", username=username)
             return ok(
                 "ok",
@@ -236,6 +228,12 @@ class UserMovie(Resource):
             collect_rating_paginate = this_user.ratings.filter(
                 Rating.category == RatingType.COLLECT
             ).paginate(args.page, args.per_page)
+            prefetch_ratings_with_movie(
+                wish_rating_paginate.items
+                + do_rating_paginate.items
+                + collect_rating_paginate.items,
+                g.current_user,
+            )
             wish_p = get_item_pagination(
                 wish_rating_paginate, "api.UserMovie", username=username
             )
@@ -295,22 +293,13 @@ class ChoiceMovie(Resource):
             query = query.filter_by(subtype=args.subtype)
         if args.year:
             query = query.filter_by(year=args.year)
-        score_stmt = (
-            sql_db.session.query(
-                Rating.movie_id.label("movie_id"),
-                func.avg(Rating.score).label("avg_score"),
-            )
-            .filter(Rating.category == RatingType.COLLECT)
-            .group_by(Rating.movie_id)
-            .order_by(desc("avg_score"))
-            .subquery()
-        )
         movies = query.subquery()
         pagination = (
             sql_db.session.query(MovieModel)
-            .outerjoin(score_stmt, MovieModel.id == score_stmt.c.movie_id)
+            .outerjoin(MovieScore, MovieModel.id == MovieScore.movie_id)
+            .options(contains_eager(MovieModel.score_info))
             .filter(MovieModel.id == movies.c.id)
-            .order_by(score_stmt.c.avg_score.desc())
+            .order_by(MovieScore.score.desc())
             .order_by(MovieModel.year.desc())
             .paginate(args.page, args.per_page)
         )
@@ -423,28 +412,27 @@ class MovieUserRating(Resource):
         parser.add_argument(
             "per_page", default=20, type=inputs.positive, location="args"
         )
+        # cursor paging only applies to sort=new
+        add_paging_arguments(parser)
         args = parser.parse_args()
         if not args.category:
             if args.sort == "new":
-                pagination = this_movie.ratings.order_by(
-                    Rating.created_at.desc()
-                ).paginate(args.page, args.per_page)
-            else:
-                s = (
-                    sql_db.session.query(
-                        rating_likes.c.rating_id, func.count("*").label("like_count")
-                    )
-                    .group_by(rating_likes.c.rating_id)
-                    .subquery()
+                pagination = paginate_query(
+                    this_movie.ratings.order_by(Rating.created_at.desc()),
+                    [Rating.created_at, Rating.id],
+                    args,
+                    total=this_movie.rating_count,
                 )
-                m = this_movie.ratings.subquery()
-                pagination = (
-                    sql_db.session.query(Rating)
-                    .outerjoin(s, Rating.id == s.c.rating_id)
-                    .filter(Rating.id == m.c.id)
-                    .order_by(s.c.like_count.desc())
-                    .paginate(args.page, args.per_page)
+            else:
+                pagination = paginate(
+                    this_movie.ratings.order_by(
+                        Rating.like_count.desc(), Rating.id.desc()
+                    ),
+                    args.page,
+                    args.per_page,
+                    total=this_movie.rating_count,
                 )
+            prefetch_ratings(pagination.items, liked_by=g.current_user)
             p = get_item_pagination(
                 pagination, "api.MovieUserRating", movie_hash_id=movie_hash_id
             )
@@ -460,28 +448,24 @@ class MovieUserRating(Resource):
         elif args.category == "collect":
             cate = RatingType.COLLECT
         if args.sort == "new":
-            pagination = (
-                this_movie.ratings.filter(Rating.category == cate)
-                .order_by(Rating.created_at.desc())
-                .paginate(args.page, args.per_page)
+            pagination = paginate_query(
+                this_movie.ratings.filter(Rating.category == cate).order_by(
+                    Rating.created_at.desc()
+                ),
+                [Rating.created_at, Rating.id],
+                args,
+                total=getattr(this_movie, args.category + "_count"),
             )
         else:
-            s = (
-                sql_db.session.query(
-                    rating_likes.c.rating_id, func.count("*").label("like_count")
-                )
-                .group_by(rating_likes.c.rating_id)
-                .subquery()
-            )
-            m = this_movie.ratings.subquery()
-            pagination = (
-                sql_db.session.query(Rating)
-                .outerjoin(s, Rating.id == s.c.rating_id)
-                .filter(Rating.id == m.c.id)
-                .filter(Rating.category == cate)
-                .order_by(s.c.like_count.desc())
-                .paginate(args.page, args.per_page)
+            pagination = paginate(
+                this_movie.ratings.filter(Rating.category == cate).order_by(
+                    Rating.like_count.desc(), Rating.id.desc()
+                ),
+                args.page,
+                args.per_page,
+                total=getattr(this_movie, args.category + "_count"),
             )
+        prefetch_ratings(pagination.items, liked_by=g.current_user)
         p = get_item_pagination(
             pagination, "api.MovieUserRating", movie_hash_id=movie_hash_id
         )
@@ -499,15 +483,15 @@ class FollowFeed(Resource):
         parser.add_argument(
             "per_page", default=20, type=inputs.positive, location="args"
         )
+        add_paging_arguments(parser)
         args = parser.parse_args()
-        s = g.current_user.followed.subquery()
-        pagination = (
-            sql_db.session.query(Rating)
-            .join(s, Rating.user_id == s.c.id)
-            .order_by(Rating.created_at.desc())
-            .paginate(args.page, args.per_page)
-        )
-
+        if is_cursor_paging(args):
+            pagination = paginate_query(
+                follow_feed_query(g.current_user), [Rating.created_at, Rating.id], args
+            )
+        else:
+            pagination = get_follow_feed(g.current_user, args.page, args.per_page)
+        prefetch_ratings_with_movie(pagination.items, g.current_user)
         p = get_item_pagination(pagination, "api.FollowFeed")
         return ok(
             "ok",
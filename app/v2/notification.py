@@ -5,6 +5,8 @@ from app import sql_db
 from app.const import NotificationType
 from app.sql_models import Notification as NotificationModel
 from app.utils.auth_decorator import auth
+from app.v2.pagination import add_paging_arguments, paginate_query
+from app.v2.prefetch import prefetch_notifications
 from app.v2.responses import (
     ErrorCode,
     error,
@@ -36,28 +38,25 @@ class Notification(Resource):
         parser.add_argument(
             "per_page", default=20, type=inputs.positive, location="args"
         )
+        add_paging_arguments(parser)
         args = parser.parse_args()
         if type_name == "friendship":
-            pagination = (
-                g.current_user.notifications_received.filter_by(
-                    category=NotificationType.FOLLOW
-                )
-                .order_by(NotificationModel.created_at.desc())
-                .paginate(args.page, args.per_page)
-            )
+            category = NotificationType.FOLLOW
         elif type_name == "like":
-            pagination = (
-                g.current_user.notifications_received.filter_by(
-                    category=NotificationType.RATING_ACTION
-                )
-                .order_by(NotificationModel.created_at.desc())
-                .paginate(args.page, args.per_page)
-            )
+            category = NotificationType.RATING_ACTION
         else:
             return error(ErrorCode.INVALID_PARAMS, 403)
+        pagination = paginate_query(
+            g.current_user.notifications_received.filter_by(category=category).order_by(
+                NotificationModel.created_at.desc()
+            ),
+            [NotificationModel.created_at, NotificationModel.id],
+            args,
+        )
         for notification in pagination.items:
             notification.is_read = True
         sql_db.session.commit()
+        prefetch_notifications(pagination.items)
         p = get_item_pagination(pagination, "api.Notification", type_name=type_name)
         return ok(
             "ok",
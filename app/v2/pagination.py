@@ -0,0 +1,94 @@
+"""
+pagination of the list endpoints
+
+offset pagination does not run an exact COUNT(*) on every request: totals
+come from the maintained counters when the caller knows them, otherwise they
+are cached per query for a short time, or estimated with `exact=false`.
+keyset pagination (see cursor.py) is opt-in by `paging=cursor` or an
+`after`/`before` cursor
+"""
+import hashlib
+
+from flask import current_app
+from flask_restful import inputs
+from flask_sqlalchemy import Pagination
+
+from app.utils.redis_utils import get_cached_count, save_cached_count
+from app.v2.cursor import cursor, cursor_paginate
+
+
+def _count_key(query):
+    statement = query.order_by(None).statement.compile()
+    signature = "{}|{}".format(statement, sorted(statement.params.items()))
+    return hashlib.md5(signature.encode()).hexdigest()
+
+
+def paginate(query, page, per_page, total=None, exact=True, count_query=None):
+    """
+    :param query: query of the items
+    :param page: current page, start from 1
+    :param per_page: items count of one page
+    :param total: known total, e.g. Movie.rating_count, nothing is counted
+    :param exact: False to estimate the total from the page when it is not
+                  cached, instead of counting
+    :param count_query: query counted instead of `query`, which must have the
+                        same count of rows but cheaper, e.g. without the joins
+                        only used by ORDER BY
+    :return: flask_sqlalchemy.Pagination
+    """
+    offset = (page - 1) * per_page
+    items = query.limit(per_page + 1).offset(offset).all()
+    has_more = len(items) > per_page
+    items = items[:per_page]
+    if total is None and not has_more and (items or page == 1):
+        total = offset + len(items)
+    if total is None:
+        count_query = count_query if count_query is not None else query
+        key = _count_key(count_query)
+        total = get_cached_count(key)
+        if total is None and exact:
+            total = count_query.order_by(None).count()
+            save_cached_count(
+                key, total, current_app.config["PAGINATION_COUNT_TIMEOUT"]
+            )
+        elif total is None:
+            # at least one more page, so the next link is returned
+            total = offset + len(items) + (per_page if has_more else 0)
+    return Pagination(query, page, per_page, total, items)
+
+
+def add_paging_arguments(parser):
+    """
+    :param parser: reqparse.RequestParser, which already has page and per_page
+    """
+    parser.add_argument("exact", default=True, type=inputs.boolean, location="args")
+    parser.add_argument(
+        "paging", default="page", choices=["page", "cursor"], location="args"
+    )
+    parser.add_argument("after", type=cursor, location="args")
+    parser.add_argument("before", type=cursor, location="args")
+
+
+def is_cursor_paging(args):
+    return args.paging == "cursor" or args.after or args.before
+
+
+def paginate_query(query, columns, args, total=None, count_query=None):
+    """
+    :param query: query ordered by `columns` desc
+    :param columns: see `cursor_paginate`
+    :param args: parsed arguments of `add_paging_arguments`, page and per_page
+    :param total: see `paginate`
+    :param count_query: see `paginate`
+    :return: flask_sqlalchemy.Pagination or CursorPagination
+    """
+    if is_cursor_paging(args):
+        return cursor_paginate(query, columns, args.per_page, args.after, args.before)
+    return paginate(
+        query,
+        args.page,
+        args.per_page,
+        total=total,
+        exact=args.exact,
+        count_query=count_query,
+    )
@@ -0,0 +1,218 @@
+"""
+batch loaders used before marshal, every relation of a page is loaded by one
+query and attached to the objects, so the field maps in responses.py do not
+lazy load row by row
+"""
+
+from sqlalchemy import inspect
+from sqlalchemy.orm import contains_eager
+from sqlalchemy.orm.attributes import set_committed_value
+
+from app.extensions import sql_db
+from app.sql_models import (
+    Celebrity,
+    Country,
+    Genre,
+    Movie,
+    MovieScore,
+    Notification,
+    Rating,
+    Tag,
+    User,
+    movie_celebrities,
+    movie_countries,
+    movie_directors,
+    movie_genres,
+    rating_likes,
+    rating_tags,
+)
+
+
+def _unloaded(objs, key):
+    return [obj for obj in objs if key in inspect(obj).unloaded]
+
+
+def _reload_expired(objs, model):
+    """
+    load the expired objects (e.g. after commit) by one query instead of one
+    refresh for every object
+    """
+    ids = [inspect(obj).identity[0] for obj in objs if inspect(obj).expired_attributes]
+    if ids:
+        model.query.filter(model.id.in_(ids)).all()
+
+
+def _prefetch_parent(objs, key, model, foreign_key):
+    """
+    many-to-one, e.g. Rating.user
+    :param objs: objects of one page
+    :param key: relationship name
+    :param model: model of the relationship
+    :param foreign_key: name of the column refers to `model`
+    :return: parents of `objs` without duplicates
+    """
+    unloaded = _unloaded(objs, key)
+    ids = {getattr(obj, foreign_key) for obj in unloaded} - {None}
+    if ids:
+        parents = {
+            parent.id: parent for parent in model.query.filter(model.id.in_(ids))
+        }
+        for obj in unloaded:
+            set_committed_value(obj, key, parents.get(getattr(obj, foreign_key)))
+    parents = {}
+    for obj in objs:
+        parent = getattr(obj, key)
+        if parent is not None:
+            parents[parent.id] = parent
+    return list(parents.values())
+
+
+def _prefetch_secondary(objs, key, model, secondary, local_key, remote_key):
+    """
+    many-to-many with a `lazy=True` list, e.g. Rating.tags
+    :param objs: objects of one page
+    :param key: relationship name
+    :param model: model of the relationship
+    :param secondary: association table
+    :param local_key: column of `secondary` refers to `objs`
+    :param remote_key: column of `secondary` refers to `model`
+    """
+    objs = _unloaded(objs, key)
+    if not objs:
+        return
+    local = secondary.c[local_key]
+    rows = (
+        sql_db.session.query(local, model)
+        .join(secondary, model.id == secondary.c[remote_key])
+        .filter(local.in_([obj.id for obj in objs]))
+        .order_by(secondary.c.id)
+    )
+    values = {obj.id: [] for obj in objs}
+    for obj_id, value in rows:
+        values[obj_id].append(value)
+    for obj in objs:
+        set_committed_value(obj, key, values[obj.id])
+
+
+def _prefetch_score_info(movies):
+    """
+    `Movie.score_info`, the foreign key is on movie_scores, so the identity map
+    never satisfies the relationship and every movie would select its row
+    :param movies: movies of one page
+    """
+    movies = _unloaded(movies, "score_info")
+    if not movies:
+        return
+    scores = {
+        score.movie_id: score
+        for score in MovieScore.query.filter(
+            MovieScore.movie_id.in_([movie.id for movie in movies])
+        )
+    }
+    for movie in movies:
+        set_committed_value(movie, "score_info", scores.get(movie.id))
+
+
+def prefetch_ratings(ratings, liked_by=None):
+    """
+    prefetch users and tags of ratings
+    :param ratings: ratings of one page
+    :param liked_by: User, prefetch whether he liked every rating
+    """
+    if not ratings:
+        return
+    _prefetch_parent(ratings, "user", User, "user_id")
+    _prefetch_secondary(ratings, "tags", Tag, rating_tags, "rating_id", "tag_id")
+    if liked_by is not None:
+        liked_ids = {
+            rating_id
+            for (rating_id,) in sql_db.session.query(rating_likes.c.rating_id).filter(
+                rating_likes.c.rating_id.in_([rating.id for rating in ratings]),
+                rating_likes.c.user_id == liked_by.id,
+            )
+        }
+        for rating in ratings:
+            rating.set_liked_by(liked_by, rating.id in liked_ids)
+
+
+def prefetch_movies(movies, rating_of=None):
+    """
+    prefetch everything `movie_resource_fields` reads
+    :param movies: movies of one page
+    :param rating_of: User, prefetch his rating on every movie
+    """
+    if not movies:
+        return
+    _prefetch_score_info(movies)
+    _prefetch_secondary(movies, "genres", Genre, movie_genres, "movie_id", "genre_id")
+    _prefetch_secondary(
+        movies, "countries", Country, movie_countries, "movie_id", "country_id"
+    )
+    _prefetch_secondary(
+        movies, "directors", Celebrity, movie_directors, "movie_id", "celebrity_id"
+    )
+    _prefetch_secondary(
+        movies, "celebrities", Celebrity, movie_celebrities, "movie_id", "celebrity_id"
+    )
+    if rating_of is not None:
+        ratings = {}
+        for rating in Rating.query.filter(
+            Rating.movie_id.in_([movie.id for movie in movies]),
+            Rating.user_id == rating_of.id,
+        ).order_by(Rating.id):
+            ratings.setdefault(rating.movie_id, rating)
+        for movie in movies:
+            movie.set_rating_of(rating_of, ratings.get(movie.id))
+        _prefetch_secondary(
+            list(ratings.values()), "tags", Tag, rating_tags, "rating_id", "tag_id"
+        )
+
+
+def prefetch_ratings_with_movie(ratings, current_user=None, movie_detail=True):
+    """
+    prefetch ratings and their movies for `rating_with_movie_resource_fields`
+    and `rating_with_movie_summary_resource_fields`
+    :param ratings: ratings of one page
+    :param current_user: User, used by the `me_to_movie` field of movies
+    :param movie_detail: prefetch the relations of movie detail
+    """
+    if not ratings:
+        return
+    prefetch_ratings(ratings)
+    movies = _prefetch_parent(ratings, "movie", Movie, "movie_id")
+    if movie_detail:
+        prefetch_movies(movies, rating_of=current_user)
+    else:
+        _prefetch_score_info(movies)
+
+
+def prefetch_notifications(notifications):
+    """
+    prefetch users and rating movies for `notification_resource_fields`
+    :param notifications: notifications of one page
+    """
+    if not notifications:
+        return
+    _reload_expired(notifications, Notification)
+    _prefetch_parent(notifications, "receiver_user", User, "receiver_user_id")
+    _prefetch_parent(notifications, "send_user", User, "sender_user_id")
+    ratings = _prefetch_parent(notifications, "rating", Rating, "rating_id")
+    _prefetch_score_info(_prefetch_parent(ratings, "movie", Movie, "movie_id"))
+
+
+def load_movies_in_order(movie_ids):
+    """
+    load the movies of a ranked page with their scores by one query
+    :param movie_ids: movie ids in rank order
+    :return: movies in the order of `movie_ids`, deleted movies are skipped
+    """
+    if not movie_ids:
+        return []
+    movies = {
+        movie.id: movie
+        for movie in sql_db.session.query(Movie)
+        .outerjoin(MovieScore, Movie.id == MovieScore.movie_id)
+        .options(contains_eager(Movie.score_info))
+        .filter(Movie.id.in_(movie_ids))
+    }
+    return [movies[movie_id] for movie_id in movie_ids if movie_id in movies]
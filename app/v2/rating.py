@@ -7,6 +7,8 @@ from app.sql_models import Rating as RatingModel
 from app.sql_models import rating_reports
 from app.utils.auth_decorator import auth, permission_required
 from app.utils.hashid import decode_str_to_id
+from app.v2.pagination import paginate
+from app.v2.prefetch import prefetch_ratings_with_movie
 from app.v2.responses import (
     ErrorCode,
     error,
@@ -79,6 +81,7 @@ class ReportedRating(Resource):
         parser.add_argument(
             "per_page", default=20, type=inputs.positive, location="args"
         )
+        parser.add_argument("exact", default=True, type=inputs.boolean, location="args")
         args = parser.parse_args()
 
         s = (
@@ -88,12 +91,17 @@ class ReportedRating(Resource):
             .group_by(rating_reports.c.rating_id)
             .subquery()
         )
-        pagination = (
+        # the join only orders the ratings, every rating is listed once
+        pagination = paginate(
             sql_db.session.query(RatingModel)
             .outerjoin(s, RatingModel.id == s.c.rating_id)
-            .order_by(s.c.report_count.desc())
-            .paginate(args.page, args.per_page)
+            .order_by(s.c.report_count.desc()),
+            args.page,
+            args.per_page,
+            exact=args.exact,
+            count_query=RatingModel.query,
         )
+        prefetch_ratings_with_movie(pagination.items, movie_detail=False)
         p = get_item_pagination(pagination, "api.ReportedRating")
         return ok(
             "ok",
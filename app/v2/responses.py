@@ -2,6 +2,7 @@ from flask import g, url_for
 from flask_restful import fields
 
 from app.utils.hashid import encode_id_to_str
+from app.v2.cursor import CursorPagination
 
 
 class ErrorCode:
@@ -104,13 +105,46 @@ class _ItemPagination:
         self.pages = pages
 
 
+def _get_cursor_item_pagination(pagination, endpoint, **kwargs):
+    prev = next = None
+    if pagination.has_prev:
+        prev = url_for(
+            endpoint,
+            before=pagination.prev_cursor,
+            per_page=pagination.per_page,
+            _external=True,
+            **kwargs
+        )
+    if pagination.has_next:
+        next = url_for(
+            endpoint,
+            after=pagination.next_cursor,
+            per_page=pagination.per_page,
+            _external=True,
+            **kwargs
+        )
+    first = url_for(
+        endpoint,
+        paging="cursor",
+        per_page=pagination.per_page,
+        _external=True,
+        **kwargs
+    )
+    return _ItemPagination(
+        pagination.items, first, None, None, None, prev=prev, next=next
+    )
+
+
 def get_item_pagination(pagination, endpoint, **kwargs):
     """
-    :param pagination: pagination object
+    :param pagination: pagination object, or CursorPagination which has no
+                       last page and total
     :param endpoint: view endpoint
     :param kwargs: other args for url_for()
     :return:
     """
+    if isinstance(pagination, CursorPagination):
+        return _get_cursor_item_pagination(pagination, endpoint, **kwargs)
     prev = next = None
     if pagination.has_prev:
         prev = url_for(
@@ -233,15 +267,11 @@ movie_resource_fields = {
     "subtype": fields.String,
     "image_url": fields.String,
     "score": fields.Float(attribute=lambda x: round(x.score, 2)),
-    "rating_count": fields.Integer(attribute=lambda x: x.ratings.count()),
+    "rating_count": fields.Integer,
     "douban_id": fields.String,
-    "wish_by_count": fields.Integer(
-        attribute=lambda x: x.user_wish_rating_query.count()
-    ),
-    "do_by_count": fields.Integer(attribute=lambda x: x.user_do_rating_query.count()),
-    "collect_by_count": fields.Integer(
-        attribute=lambda x: x.user_collect_query.count()
-    ),
+    "wish_by_count": fields.Integer(attribute="wish_count"),
+    "do_by_count": fields.Integer(attribute="do_count"),
+    "collect_by_count": fields.Integer(attribute="collect_count"),
     "cinema_status": fields.Integer,
     "seasons_count": fields.Integer,
     "episodes_count": fields.Integer,
@@ -256,7 +286,7 @@ movie_resource_fields = {
     "me_to_movie": fields.Nested(
         rating_without_user_resource_fields,
         allow_null=True,
-        attribute=lambda x: x.ratings.filter_by(user_id=g.current_user.id).first(),
+        attribute=lambda x: x.rating_of(g.current_user),
     ),
 }
 
@@ -282,9 +312,7 @@ rating_resource_fields = {
     "user_avatar": fields.String(attribute=lambda x: x.user.avatar_thumb),
     "like_count": fields.Integer,
     "me_like_rating": fields.Boolean(
-        attribute=lambda x: True
-        if x.like_by_users.filter_by(id=g.current_user.id).first()
-        else False
+        attribute=lambda x: x.is_liked_by(g.current_user)
     ),
     "tags": fields.String(
         attribute=lambda x: [tag.tag_name for tag in x.tags if x.tags]
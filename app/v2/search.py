@@ -1,5 +1,6 @@
 from flask_restful import Resource, inputs, marshal, reqparse
 from flask_sqlalchemy import Pagination
+from sqlalchemy.orm import joinedload
 
 from app.sql_models import Celebrity, Movie, User
 from app.v2.responses import (
@@ -10,11 +11,9 @@ from app.v2.responses import (
     ok,
     user_resource_fields,
 )
-from app.extensions import cache
 
 
 class Search(Resource):
-    @cache.cached(timeout=60, query_string=True)
     def get(self):
         parser = reqparse.RequestParser()
         parser.add_argument(
@@ -29,10 +28,18 @@ class Search(Resource):
             "per_page", default=20, type=inputs.positive, location="args"
         )
         args = parser.parse_args()
+        # the ids of hits are cached by `search`, the rows are loaded by one query
         if args.cate == "movie":
-            items, total = Movie.search(args.q, args.page, args.per_page)
+            items, total = Movie.search(
+                args.q, args.page, args.per_page, [joinedload(Movie.score_info)]
+            )
         elif args.cate == "people":
-            items, total = User.search(args.q, args.page, args.per_page)
+            items, total = User.search(
+                args.q,
+                args.page,
+                args.per_page,
+                [joinedload(User.city), joinedload(User.roles)],
+            )
         else:
             items, total = Celebrity.search(args.q, args.page, args.per_page)
         pagination = Pagination("", args.page, args.per_page, total, items)
@@ -0,0 +1,36 @@
+from flask_restful import Resource
+
+from app.utils.auth_decorator import auth, permission_required
+from app.utils.redis_utils import clear_endpoint_stats, get_endpoint_stats
+from app.v2.responses import ok
+
+
+class EndpointStats(Resource):
+    @auth.login_required
+    @permission_required("ADMINISTER")
+    def get(self):
+        data = []
+        for endpoint, stats in get_endpoint_stats().items():
+            requests = stats.get("requests", 0)
+            if not requests:
+                continue
+            data.append(
+                {
+                    "endpoint": endpoint,
+                    "requests": requests,
+                    "avg_ms": stats.get("total_time_us", 0) / requests / 1000,
+                    "avg_db_queries": stats.get("db_count", 0) / requests,
+                    "avg_db_ms": stats.get("db_time_us", 0) / requests / 1000,
+                    "avg_redis_commands": stats.get("redis_count", 0) / requests,
+                    "avg_es_requests": stats.get("es_count", 0) / requests,
+                    "avg_es_ms": stats.get("es_time_us", 0) / requests / 1000,
+                }
+            )
+        data.sort(key=lambda item: item["avg_db_queries"], reverse=True)
+        return ok("ok", data=data)
+
+    @auth.login_required
+    @permission_required("ADMINISTER")
+    def delete(self):
+        clear_endpoint_stats()
+        return ok("Cleared Endpoint Stats Successfully!")
@@ -6,17 +6,20 @@ from app.const import AccountOperations
 from app.extensions import sql_db
 from app.sql_models import Role
 from app.sql_models import User as UserModel, ChinaArea as ChinaAreaModel, Image
+from app.sql_models import followers
 from app.tasks.email import (
     send_change_email_email,
     send_confirm_email,
     send_reset_password_email,
 )
+from app.tasks.feed import fill_timeline, unfollow_timeline
 from app.utils.auth_decorator import auth, permission_required
 from app.utils.auth_utils import (
     generate_email_confirm_token,
     validate_email_confirm_token,
 )
 from app.utils.redis_utils import test_limit_of_send_email
+from app.v2.pagination import add_paging_arguments, paginate_query
 from app.v2.responses import (
     ErrorCode,
     error,
@@ -199,14 +202,16 @@ class Follow(Resource):
         parser.add_argument(
             "per_page", default=20, type=inputs.positive, location="args"
         )
+        add_paging_arguments(parser)
         args = parser.parse_args()
         this_user = UserModel.query.filter_by(username=username).first()
         if not this_user:
             return error(ErrorCode.USER_NOT_FOUND, 404)
+        # followers.created_at is not reliable, the cursor is on followers.id
         if follower_or_following.lower() == "follower":
-            pagination = this_user.followers.paginate(args.page, args.per_page)
+            pagination = paginate_query(this_user.followers, [followers.c.id], args)
         if follower_or_following.lower() == "following":
-            pagination = this_user.followed.paginate(args.page, args.per_page)
+            pagination = paginate_query(this_user.followed, [followers.c.id], args)
         p = get_item_pagination(
             pagination,
             "api.Follow",
@@ -228,6 +233,7 @@ class Follow(Resource):
             return error(ErrorCode.USER_NOT_FOUND, 404)
         if g.current_user.follow(this_user):
             sql_db.session.commit()
+            fill_timeline.delay(g.current_user.id, this_user.id)
             return ok(message="关注成功", http_status_code=201)
         else:
             return error(ErrorCode.FOLLOW_ALREADY_EXISTS, 403)
@@ -241,6 +247,7 @@ class Follow(Resource):
             return error(ErrorCode.USER_NOT_FOUND, 404)
         if g.current_user.unfollow(this_user):
             sql_db.session.commit()
+            unfollow_timeline.delay(g.current_user.id, this_user.id)
             return ok(message="取消关注成功")
         else:
             return error(ErrorCode.FOLLOW_NOT_EXISTS, 403)
@@ -0,0 +1,117 @@
+"""
+synthetic dataset for the benchmarks, generated through the models so the
+counters, rank and similarity state in redis are written as in production
+"""
+import random
+
+from faker import Faker
+from werkzeug.security import generate_password_hash
+
+from app.const import MovieType, RatingType
+from app.extensions import sql_db as db
+from app.sql_models import Movie, User
+
+PASSWORD = "benchmark"
+
+GENRES = [
+    "剧情",
+    "喜剧",
+    "动作",
+    "爱情",
+    "科幻",
+    "动画",
+    "悬疑",
+    "惊悚",
+    "恐怖",
+    "纪录片",
+]
+COUNTRIES = ["中国大陆", "美国", "香港", "日本", "韩国", "英国", "法国"]
+
+
+def seed(users=200, movies=500, ratings=5000, likes=2000, follows=1000, seed=0):
+    """
+    fill an empty database
+    :param users: count of users
+    :param movies: count of movies
+    :param ratings: count of ratings, at most one rating per (user, movie)
+    :param likes: count of rating likes
+    :param follows: count of follows
+    :param seed: random seed, the same seed generates the same dataset
+    :return: list of User
+    """
+    rand = random.Random(seed)
+    fake = Faker("zh_CN")
+    fake.seed_instance(seed)
+
+    password_hash = generate_password_hash(PASSWORD)
+    user_objs = []
+    for i in range(users):
+        user = User(username="bench%d" % i, email="bench%d@example.com" % i)
+        user.password_hash = password_hash
+        user.signature = fake.sentence()
+        user_objs.append(user)
+    db.session.add_all(user_objs)
+    db.session.commit()
+
+    movie_objs = []
+    for i in range(movies):
+        subtype = rand.choice([MovieType.MOVIE, MovieType.TV])
+        movie = Movie.create_one(
+            title=fake.sentence(nb_words=3)[:64],
+            subtype=subtype,
+            year=rand.randint(1980, 2020),
+            douban_id=i + 1,
+            summary=fake.text(),
+            seasons_count=1 if subtype == MovieType.TV else None,
+            genres_name=rand.sample(GENRES, rand.randint(1, 3)),
+            countries_name=rand.sample(COUNTRIES, rand.randint(1, 2)),
+        )
+        db.session.add(movie)
+        movie_objs.append(movie)
+    db.session.commit()
+
+    # popular movies get most of the ratings, as in real data
+    weights = [1.0 / (rank + 1) for rank in range(len(movie_objs))]
+    rated = set()
+    rating_count = 0
+    while rating_count < min(ratings, users * movies):
+        user = rand.choice(user_objs)
+        movie = rand.choices(movie_objs, weights)[0]
+        if (user.id, movie.id) in rated:
+            continue
+        rated.add((user.id, movie.id))
+        category = rand.choice(
+            [RatingType.WISH, RatingType.DO, RatingType.COLLECT, RatingType.COLLECT]
+        )
+        comment = fake.sentence()
+        tags_name = [fake.word()[:8] for _ in range(rand.randint(0, 3))]
+        if category == RatingType.WISH:
+            user.wish_movie(movie, comment, tags_name)
+        elif category == RatingType.DO and movie.subtype == MovieType.TV:
+            user.do_movie(movie, rand.randint(1, 10), comment, tags_name)
+        else:
+            user.collect_movie(movie, rand.randint(1, 10), comment, tags_name)
+        rating_count += 1
+        if rating_count % 500 == 0:
+            db.session.commit()
+    db.session.commit()
+
+    all_ratings = [rating for user in user_objs for rating in user.ratings]
+    like_count = attempts = 0
+    while like_count < likes and attempts < likes * 10:
+        attempts += 1
+        rating = rand.choice(all_ratings)
+        user = rand.choice(user_objs)
+        if rating.user_id != user.id and rating.like_by(user):
+            like_count += 1
+    db.session.commit()
+
+    follow_count = attempts = 0
+    while follow_count < follows and attempts < follows * 10:
+        attempts += 1
+        user, followed = rand.choice(user_objs), rand.choice(user_objs)
+        if user.id != followed.id and not user.is_following(followed):
+            user.follow(followed)
+            follow_count += 1
+    db.session.commit()
+    return user_objs
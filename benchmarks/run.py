@@ -0,0 +1,210 @@
+"""
+benchmark the api hot paths against a synthetic dataset
+
+    python -m benchmarks.run --users 200 --movies 500 --ratings 5000
+
+uses config `benchmark`: database `<MYSQL_DATABASE>_bench` and redis db 15,
+both are emptied before seeding
+"""
+import argparse
+import random
+import time
+
+import numpy as np
+from flask import url_for
+from sqlalchemy import event
+
+from app import create_app
+from app.extensions import redis_store, sql_db
+from app.sql_models import Genre, Movie, Rating, User
+from app.tasks.feed import fill_timeline
+from app.tasks.recommender import get_item_similarity, refresh_user_recommendations
+from app.utils.hashid import encode_id_to_str
+from benchmarks.dataset import seed
+
+
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, conn, cursor, statement, parameters, context, executemany):
+        self.count += 1
+
+
+def measure(func, runs, counter):
+    """
+    :param func: callable of one run, return False when the run failed
+    :param runs: count of runs
+    :param counter: QueryCounter of the engine
+    :return: (latencies in ms, query counts, count of failed runs)
+    """
+    latencies, queries, failed = [], [], 0
+    for _ in range(runs):
+        counter.count = 0
+        start = time.perf_counter()
+        if func() is False:
+            failed += 1
+        latencies.append((time.perf_counter() - start) * 1000)
+        queries.append(counter.count)
+    return latencies, queries, failed
+
+
+def report(name, latencies, queries, failed):
+    p50, p90, p99 = np.percentile(latencies, [50, 90, 99])
+    print(
+        "{:<28}{:>6}{:>10.1f}{:>10.1f}{:>10.1f}{:>10.1f}{:>10.1f}{:>8}{:>8}".format(
+            name,
+            len(latencies),
+            p50,
+            p90,
+            p99,
+            max(latencies),
+            float(np.mean(queries)),
+            max(queries),
+            failed,
+        )
+    )
+
+
+def get_cases(app, rand):
+    """
+    :return: [(name, [url, ...])], urls of every case are requested in turn
+    """
+    with app.app_context():
+        movie_ids = [
+            movie_id
+            for (movie_id,) in sql_db.session.query(Rating.movie_id)
+            .group_by(Rating.movie_id)
+            .order_by(sql_db.func.count(Rating.id).desc())
+            .limit(20)
+        ]
+        genre_names = [genre.genre_name for genre in Genre.query]
+    with app.test_request_context():
+        return [
+            ("MovieRecommend", [url_for("api.MovieRecommend", page=1)]),
+            ("FollowFeed", [url_for("api.FollowFeed", page=1)]),
+            (
+                "MovieUserRating sort=hot",
+                [
+                    url_for(
+                        "api.MovieUserRating",
+                        movie_hash_id=encode_id_to_str(movie_id),
+                        sort="hot",
+                    )
+                    for movie_id in movie_ids
+                ],
+            ),
+            (
+                "ChoiceMovie",
+                [
+                    url_for("api.ChoiceMovie", genre_name=genre_name, page=page)
+                    for genre_name in genre_names
+                    for page in (1, 2)
+                ],
+            ),
+            ("LeaderBoard week", [url_for("api.LeaderBoard", time_range="week")]),
+            ("LeaderBoard month", [url_for("api.LeaderBoard", time_range="month")]),
+            (
+                "Movie",
+                [
+                    url_for("api.Movie", movie_hash_id=encode_id_to_str(movie_id))
+                    for movie_id in rand.sample(movie_ids, len(movie_ids))
+                ],
+            ),
+        ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--movies", type=int, default=500)
+    parser.add_argument("--ratings", type=int, default=5000)
+    parser.add_argument("--likes", type=int, default=2000)
+    parser.add_argument("--follows", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--requests", type=int, default=50, help="requests of every endpoint"
+    )
+    parser.add_argument("--similarity-runs", type=int, default=3)
+    parser.add_argument(
+        "--skip-seed", action="store_true", help="reuse the seeded database"
+    )
+    args = parser.parse_args()
+
+    app = create_app("benchmark")
+    rand = random.Random(args.seed)
+    with app.app_context():
+        if not args.skip_seed:
+            print("seeding ...")
+            sql_db.drop_all()
+            sql_db.create_all()
+            redis_store.flushdb()
+            seed(
+                users=args.users,
+                movies=args.movies,
+                ratings=args.ratings,
+                likes=args.likes,
+                follows=args.follows,
+                seed=args.seed,
+            )
+        counter = QueryCounter()
+        event.listen(sql_db.engine, "before_cursor_execute", counter)
+        print(
+            "{} users, {} movies, {} ratings".format(
+                User.query.count(), Movie.query.count(), Rating.query.count()
+            )
+        )
+        results = [
+            (
+                "get_item_similarity",
+                measure(get_item_similarity, args.similarity_runs, counter),
+            )
+        ]
+        # the user with most ratings, recommendations come from item-cf
+        user_id = (
+            sql_db.session.query(Rating.user_id)
+            .group_by(Rating.user_id)
+            .order_by(sql_db.func.count(Rating.id).desc())
+            .limit(1)
+            .scalar()
+        )
+        token = User.query.get(user_id).generate_token()
+        # tasks are not run by the benchmark config, seed what the cases read
+        refresh_user_recommendations(full=True)
+        fill_timeline(user_id)
+        sql_db.session.remove()
+
+    headers = {"Authorization": "Bearer " + token}
+    client = app.test_client()
+    for name, urls in get_cases(app, rand):
+        urls = iter(urls * (args.requests // len(urls) + 1))
+        results.append(
+            (
+                name,
+                measure(
+                    lambda: client.get(next(urls), headers=headers).status_code == 200,
+                    args.requests,
+                    counter,
+                ),
+            )
+        )
+
+    print(
+        "{:<28}{:>6}{:>10}{:>10}{:>10}{:>10}{:>10}{:>8}{:>8}".format(
+            "",
+            "n",
+            "p50 ms",
+            "p90 ms",
+            "p99 ms",
+            "max ms",
+            "queries",
+            "max q",
+            "failed",
+        )
+    )
+    for name, (latencies, queries, failed) in results:
+        report(name, latencies, queries, failed)
+
+
+if __name__ == "__main__":
+    main()
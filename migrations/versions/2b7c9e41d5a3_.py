@@ -0,0 +1,54 @@
+"""add table movie_scores
+
+Revision ID: 2b7c9e41d5a3
+Revises: 39d1878fedad
+Create Date: 2026-10-18 09:12:40.318455
+
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = "2b7c9e41d5a3"
+down_revision = "39d1878fedad"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "movie_scores",
+        sa.Column("id", sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column("created_at", sa.DateTime(), nullable=True),
+        sa.Column("updated_at", sa.DateTime(), nullable=True),
+        sa.Column("movie_id", sa.Integer(), nullable=False),
+        sa.Column("wish_count", sa.Integer(), nullable=False),
+        sa.Column("do_count", sa.Integer(), nullable=False),
+        sa.Column("collect_count", sa.Integer(), nullable=False),
+        sa.Column("score_sum", sa.Integer(), nullable=False),
+        sa.Column("score_count", sa.Integer(), nullable=False),
+        sa.Column("score", sa.Float(), nullable=True),
+        sa.ForeignKeyConstraint(["movie_id"], ["movies.id"], ondelete="CASCADE"),
+        sa.PrimaryKeyConstraint("id"),
+        sa.UniqueConstraint("movie_id"),
+    )
+    op.create_index(
+        op.f("ix_movie_scores_score"), "movie_scores", ["score"], unique=False
+    )
+    # fill the table from the existing ratings
+    op.execute(
+        "INSERT INTO movie_scores (created_at, movie_id, wish_count, do_count, "
+        "collect_count, score_sum, score_count, score) "
+        "SELECT NOW(), movie_id, "
+        "SUM(category = 0), SUM(category = 1), SUM(category = 2), "
+        "COALESCE(SUM(CASE WHEN category = 2 THEN score END), 0), "
+        "COUNT(CASE WHEN category = 2 THEN score END), "
+        "AVG(CASE WHEN category = 2 THEN score END) "
+        "FROM ratings GROUP BY movie_id"
+    )
+
+
+def downgrade():
+    op.drop_index(op.f("ix_movie_scores_score"), table_name="movie_scores")
+    op.drop_table("movie_scores")
@@ -0,0 +1,38 @@
+"""add indexes for keyset pagination
+
+Revision ID: 7d3f0a9c8e12
+Revises: 2b7c9e41d5a3
+Create Date: 2026-10-18 14:05:22.610934
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = "7d3f0a9c8e12"
+down_revision = "2b7c9e41d5a3"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index(
+        "ix_ratings_movie_id_created_at",
+        "ratings",
+        ["movie_id", "created_at"],
+        unique=False,
+    )
+    op.create_index(
+        "ix_notification_receiver_user_id_category_created_at",
+        "notification",
+        ["receiver_user_id", "category", "created_at"],
+        unique=False,
+    )
+
+
+def downgrade():
+    op.drop_index(
+        "ix_notification_receiver_user_id_category_created_at",
+        table_name="notification",
+    )
+    op.drop_index("ix_ratings_movie_id_created_at", table_name="ratings")
@@ -0,0 +1,40 @@
+"""add column ratings.like_count
+
+Revision ID: 9c41e7b2a0f6
+Revises: 7d3f0a9c8e12
+Create Date: 2026-10-18 16:27:03.118472
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = "9c41e7b2a0f6"
+down_revision = "7d3f0a9c8e12"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column(
+        "ratings",
+        sa.Column("like_count", sa.Integer(), server_default="0", nullable=False),
+    )
+    # fill the column from the existing likes
+    op.execute(
+        "UPDATE ratings JOIN ("
+        "SELECT rating_id, COUNT(*) AS like_count FROM rating_likes "
+        "GROUP BY rating_id) AS likes ON ratings.id = likes.rating_id "
+        "SET ratings.like_count = likes.like_count"
+    )
+    op.create_index(
+        "ix_ratings_movie_id_category_like_count",
+        "ratings",
+        ["movie_id", "category", "like_count"],
+        unique=False,
+    )
+
+
+def downgrade():
+    op.drop_index("ix_ratings_movie_id_category_like_count", table_name="ratings")
+    op.drop_column("ratings", "like_count")
@@ -0,0 +1,28 @@
+"""add index ratings(movie_id, like_count, id)
+
+Revision ID: b5d29e0c4a71
+Revises: 9c41e7b2a0f6
+Create Date: 2026-10-18 21:05:47.306215
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = "b5d29e0c4a71"
+down_revision = "9c41e7b2a0f6"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index(
+        "ix_ratings_movie_id_like_count",
+        "ratings",
+        ["movie_id", "like_count", "id"],
+        unique=False,
+    )
+
+
+def downgrade():
+    op.drop_index("ix_ratings_movie_id_like_count", table_name="ratings")
@@ -22,3 +22,8 @@ class BasicsTestCase(unittest.TestCase):
 
     def test_app_is_testing(self):
         self.assertTrue(current_app.config["TESTING"])
+
+    def test_server_timing_header(self):
+        response = self.app.test_client().get("/api/v2/genre")
+        self.assertEqual(response.status_code, 401)
+        self.assertIn("db;dur=", response.headers["Server-Timing"])
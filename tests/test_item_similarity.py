@@ -0,0 +1,119 @@
+import math
+import random
+import unittest
+
+from app.utils.item_similarity import (
+    compute_cooccurrence,
+    compute_item_similarity,
+    cosine_similarity,
+    csr_to_dict,
+    rank_candidates,
+    rescale_rows,
+    top_k_neighbours,
+)
+
+
+def _loop_item_similarity(ratings):
+    """the nested-loop implementation `get_item_similarity` used to run"""
+    user_ratings = {}
+    for user_id, movie_id in ratings:
+        user_ratings.setdefault(user_id, []).append(movie_id)
+    count = {}
+    N = {}
+    for movie_ids in user_ratings.values():
+        for i in movie_ids:
+            N[i] = N.get(i, 0) + 1
+            for j in movie_ids:
+                if i == j:
+                    continue
+                count.setdefault(i, {})
+                count[i][j] = count[i].get(j, 0) + 1
+    res = {}
+    for u, related_items in count.items():
+        for v, cij in related_items.items():
+            res.setdefault(u, {})[v] = cij / math.sqrt(N[u] * N[v])
+    return res
+
+
+class ItemSimilarityTestCase(unittest.TestCase):
+    def test_same_as_loop_implementation(self):
+        rnd = random.Random(4399)
+        ratings = list({(rnd.randint(1, 60), rnd.randint(1, 200)) for _ in range(1500)})
+        user_ids = [r[0] for r in ratings]
+        movie_ids = [r[1] for r in ratings]
+        self.assertEqual(
+            compute_item_similarity(user_ids, movie_ids),
+            _loop_item_similarity(ratings),
+        )
+
+    def test_items_without_cooccurrence_are_skipped(self):
+        res = compute_item_similarity([1, 1, 2], [10, 11, 12])
+        self.assertEqual(res, {10: {11: 1.0}, 11: {10: 1.0}})
+
+    def test_rescaled_rows_same_as_rebuild(self):
+        rnd = random.Random(7)
+        ratings = {(rnd.randint(1, 40), rnd.randint(1, 80)) for _ in range(600)}
+        item_ids, count, n = compute_cooccurrence(*zip(*ratings))
+        count_rows = csr_to_dict(item_ids, count)
+        n = dict(zip(item_ids.tolist(), n.tolist()))
+        changed = set()
+        for _ in range(50):
+            user_id, movie_id = rnd.randint(1, 40), rnd.randint(1, 90)
+            step = -1 if (user_id, movie_id) in ratings else 1
+            ratings ^= {(user_id, movie_id)}
+            changed.add(movie_id)
+            # the delta `User._add_rating_to_similarity` emits
+            n[movie_id] = n.get(movie_id, 0) + step
+            for u, j in ratings:
+                if u == user_id and j != movie_id:
+                    row = count_rows.setdefault(movie_id, {})
+                    row[j] = row.get(j, 0) + step
+                    row = count_rows.setdefault(j, {})
+                    row[movie_id] = row.get(movie_id, 0) + step
+        rows = rescale_rows({i: count_rows.get(i, {}) for i in changed}, n)
+        expected = compute_item_similarity(*zip(*ratings))
+        for i, row in rows.items():
+            row = {j: w for j, w in row.items() if w > 0}
+            self.assertEqual(row.keys(), expected.get(i, {}).keys())
+            for j, w in row.items():
+                self.assertAlmostEqual(w, expected[i][j])
+
+    def test_top_k_neighbours(self):
+        rnd = random.Random(42)
+        ratings = {(rnd.randint(1, 30), rnd.randint(1, 50)) for _ in range(400)}
+        item_ids, count, n = compute_cooccurrence(*zip(*ratings))
+        neighbours = top_k_neighbours(item_ids, cosine_similarity(count, n), 5)
+        for i, row in compute_item_similarity(*zip(*ratings)).items():
+            weights = sorted(row.values(), reverse=True)[0:5]
+            self.assertEqual([w for _, w in neighbours[i]], weights)
+            for j, w in neighbours[i]:
+                self.assertEqual(row[j], w)
+
+    def test_rank_candidates(self):
+        rnd = random.Random(5)
+        rated = {movie_id: rnd.randint(0, 10) for movie_id in range(1, 8)}
+        neighbours = {
+            i: [(rnd.randint(1, 30), rnd.random()) for _ in range(5)] for i in rated
+        }
+        expected = {}
+        for i, score in rated.items():
+            for j, wj in neighbours[i]:
+                if j in rated:
+                    continue
+                expected[j] = expected.get(j, 0) + wj * score
+        movie_ids = list(rated)
+        entries = [
+            (owner, j, wj)
+            for owner, i in enumerate(movie_ids)
+            for j, wj in neighbours[i]
+        ]
+        ids, scores = rank_candidates(
+            *zip(*entries), [rated[i] for i in movie_ids], movie_ids
+        )
+        self.assertEqual(set(ids.tolist()), set(expected))
+        self.assertEqual(list(scores), sorted(scores, reverse=True))
+        for j, score in zip(ids.tolist(), scores.tolist()):
+            self.assertAlmostEqual(score, expected[j])
+
+    def test_empty(self):
+        self.assertEqual(compute_item_similarity([], []), {})
@@ -1,3 +1,6 @@
+import datetime
+import os
+import tempfile
 import unittest
 import time
 
@@ -15,8 +18,38 @@ from app.sql_models import (
     Genre,
     Country,
     Tag,
+    MovieScore,
+)
+from app.extensions import cache, redis_store, sql_db as db
+from app.feed import get_follow_feed
+from app.tasks.feed import (
+    fan_out_ratings,
+    fill_timeline,
+    push_author_to_timelines,
+    remove_author_from_timelines,
+    unfollow_timeline,
+)
+from app.tasks.recommender import rebuild_rank_data
+from app.tasks.search import sync_search_index
+from app.utils.local_search import LocalSearchIndex, tokenize
+from app.utils.redis_utils import (
+    finish_similarity_rebuild,
+    get_rank_movie_ids,
+    get_rank_version,
+    get_timeline,
+    pop_search_outbox,
+    rebuild_rank_windows,
+    requeue_search_outbox,
+    save_similarity_state,
+    start_similarity_rebuild,
+)
+from app.v2.cursor import cursor, cursor_paginate
+from app.v2.pagination import _count_key, paginate
+from app.v2.prefetch import (
+    load_movies_in_order,
+    prefetch_ratings,
+    prefetch_ratings_with_movie,
 )
-from app.extensions import sql_db as db
 
 fake = Faker()
 
@@ -373,3 +406,494 @@ class UserModelsTestCase(unittest.TestCase):
         # self.assertEqual(user_one.notifications_received.count(), 0)
         # self.assertEqual(user_two.notifications_sent.count(), 0)
         # self.assertEqual(user_one.notifications_count, 0)
+
+    def test_movie_score(self):
+        movie_one = Movie.create_one(title="one", subtype=MovieType.MOVIE, year=2006)
+        movie_two = Movie.create_one(title="two", subtype=MovieType.MOVIE, year=2006)
+        db.session.add_all([movie_one, movie_two])
+        db.session.commit()
+        user_one = User.create_one(
+            username="user_one", email=fake.email(), password="123456"
+        )
+        user_two = User.create_one(
+            username="user_two", email=fake.email(), password="123456"
+        )
+        user_one.collect_movie(movie_one, 6, "Bad")
+        user_two.collect_movie(movie_one, 9, "Good")
+        user_two.wish_movie(movie_two, "Wish")
+        db.session.commit()
+        self.assertEqual(movie_one.collect_count, 2)
+        self.assertEqual(movie_one.rating_count, 2)
+        self.assertEqual(movie_one.score, 7.5)
+        self.assertEqual(movie_two.wish_count, 1)
+        self.assertEqual(movie_two.score, 0)
+        self.assertIsNone(movie_two.score_info.score)
+        self.assertEqual(MovieScore.rebuild(), 0)
+        user_two.delete_rating_on(movie_one)
+        db.session.commit()
+        self.assertEqual(movie_one.collect_count, 1)
+        self.assertEqual(movie_one.score, 6)
+        self.assertEqual(MovieScore.rebuild(), 0)
+        movie_one.score_info.collect_count = 5
+        db.session.commit()
+        self.assertEqual(MovieScore.rebuild(), 1)
+        db.session.commit()
+        self.assertEqual(movie_one.collect_count, 1)
+
+    def test_prefetch_ratings(self):
+        movie_one = Movie.create_one(
+            title="one", subtype=MovieType.MOVIE, year=2006, genres_name=["励志"]
+        )
+        db.session.add(movie_one)
+        db.session.commit()
+        user_one = User.create_one(
+            username="user_one", email=fake.email(), password="123456"
+        )
+        user_two = User.create_one(
+            username="user_two", email=fake.email(), password="123456"
+        )
+        user_one.collect_movie(movie_one, 6, "Bad", tags_name=["B", "D"])
+        user_two.wish_movie(movie_one, "Wish", tags_name=["W"])
+        db.session.commit()
+        movie_one.ratings.filter_by(user_id=user_one.id).first().like_by(user_two)
+        db.session.commit()
+        expected = [
+            (
+                rating.user.username,
+                [tag.tag_name for tag in rating.tags],
+                rating.like_count,
+                rating.is_liked_by(user_two),
+                rating.movie.title,
+                [genre.genre_name for genre in rating.movie.genres],
+                rating.movie.rating_of(user_one).id,
+                rating.movie.score,
+                rating.movie.rating_count,
+            )
+            for rating in Rating.query.order_by(Rating.id)
+        ]
+        db.session.expunge_all()
+        user_one = User.query.get(user_one.id)
+        user_two = User.query.get(user_two.id)
+        ratings = Rating.query.order_by(Rating.id).all()
+        prefetch_ratings(ratings, liked_by=user_two)
+        prefetch_ratings_with_movie(ratings, user_one)
+        queries = []
+
+        def count_query(*args):
+            queries.append(args)
+
+        db.event.listen(db.engine, "before_cursor_execute", count_query)
+        prefetched = [
+            (
+                rating.user.username,
+                [tag.tag_name for tag in rating.tags],
+                rating.like_count,
+                rating.is_liked_by(user_two),
+                rating.movie.title,
+                [genre.genre_name for genre in rating.movie.genres],
+                rating.movie.rating_of(user_one).id,
+                rating.movie.score,
+                rating.movie.rating_count,
+            )
+            for rating in ratings
+        ]
+        db.event.remove(db.engine, "before_cursor_execute", count_query)
+        self.assertEqual(prefetched, expected)
+        # everything the field maps read is prefetched
+        self.assertEqual(len(queries), 0)
+
+    def test_auth_token_cache(self):
+        user = User.create_one(username="user_one", email=fake.email(), password="1")
+        db.session.add(user)
+        db.session.commit()
+        token = user.generate_token()
+        self.assertEqual(User.verity_auth_token(token), user)
+        db.session.remove()
+        current_user = User.verity_auth_token(token)
+        self.assertEqual(current_user.username, "user_one")
+        self.assertTrue(current_user.validate_password("1"))
+        current_user.change_password("2")
+        db.session.commit()
+        db.session.remove()
+        self.assertIsNone(User.verity_auth_token(token))
+        token = User.query.filter_by(username="user_one").first().generate_token()
+        self.assertEqual(User.verity_auth_token(token).username, "user_one")
+
+    def test_similarity_deltas(self):
+        movie = Movie.create_one(title="one", subtype=MovieType.MOVIE, year=2006)
+        user = User.create_one(username="user_one", email=fake.email(), password="1")
+        db.session.add_all([movie, user])
+        db.session.commit()
+        redis_store.hdel("item-cf:n", movie.id)
+        user.collect_movie(movie, 8, "Good")
+        # applied only when the rating is committed
+        self.assertIsNone(redis_store.hget("item-cf:n", movie.id))
+        db.session.rollback()
+        self.assertIsNone(redis_store.hget("item-cf:n", movie.id))
+        user.collect_movie(movie, 8, "Good")
+        db.session.commit()
+        self.assertEqual(redis_store.hget("item-cf:n", movie.id), b"1")
+        # deltas committed during a full rebuild are applied to its state
+        other = Movie.create_one(title="two", subtype=MovieType.MOVIE, year=2006)
+        db.session.add(other)
+        db.session.commit()
+        start_similarity_rebuild()
+        user.collect_movie(other, 6, "Bad")
+        db.session.commit()
+        self.assertIsNone(redis_store.hget("item-cf:n", other.id))
+        save_similarity_state({}, {movie.id: 1})
+        finish_similarity_rebuild()
+        self.assertEqual(redis_store.hget("item-cf:n", other.id), b"1")
+        self.assertEqual(
+            redis_store.hget("item-cf:count:" + str(movie.id), other.id), b"1"
+        )
+
+    def test_follow_feed(self):
+        movies = [
+            Movie.create_one(title=title, subtype=MovieType.MOVIE, year=2006)
+            for title in ("one", "two")
+        ]
+        db.session.add_all(movies)
+        users = [
+            User.create_one(username=name, email=fake.email(), password="123456")
+            for name in ("user_one", "user_two", "user_three")
+        ]
+        db.session.add_all(users)
+        db.session.commit()
+        user_one, user_two, user_three = users
+        user_three.follow(user_one)
+        user_three.follow(user_two)
+        user_one.collect_movie(movies[0], 8, "Good")
+        user_two.wish_movie(movies[0], "Wish")
+        db.session.commit()
+        redis_store.delete("timeline:" + str(user_three.id))
+
+        def feed():
+            return sorted(
+                rating.id for rating in get_follow_feed(user_three, 1, 20).items
+            )
+
+        expected = sorted(
+            rating.id
+            for rating in Rating.query.filter(
+                Rating.user_id.in_([user_one.id, user_two.id])
+            )
+        )
+        self.assertEqual(feed(), expected)
+        fill_timeline(user_three.id)
+        self.assertEqual(get_follow_feed(user_three, 1, 20).total, 2)
+        self.assertEqual(feed(), expected)
+        user_one.collect_movie(movies[1], 6, "Bad")
+        db.session.commit()
+        rating = Rating.query.filter_by(user_id=user_one.id, movie_id=movies[1].id)
+        fan_out_ratings([rating.first().id])
+        self.assertEqual(get_follow_feed(user_three, 1, 20).total, 3)
+        user_three.unfollow(user_two)
+        db.session.commit()
+        unfollow_timeline(user_three.id, user_two.id)
+        self.assertEqual(
+            [rating.user_id for rating in get_follow_feed(user_three, 1, 20).items],
+            [user_one.id, user_one.id],
+        )
+
+    def test_follow_feed_celebrity(self):
+        movies = [
+            Movie.create_one(title=title, subtype=MovieType.MOVIE, year=2006)
+            for title in ("one", "two")
+        ]
+        db.session.add_all(movies)
+        users = [
+            User.create_one(username=name, email=fake.email(), password="123456")
+            for name in ("user_one", "user_two", "user_three")
+        ]
+        db.session.add_all(users)
+        db.session.commit()
+        user_one, user_two, user_three = users
+        user_three.follow(user_one)
+        user_three.follow(user_two)
+        user_one.collect_movie(movies[0], 8, "Good")
+        user_one.collect_movie(movies[1], 6, "Bad")
+        user_two.wish_movie(movies[0], "Wish")
+        db.session.commit()
+        redis_store.delete("timeline:" + str(user_three.id))
+        redis_store.srem("feed:celebrities", user_two.id)
+        redis_store.sadd("feed:celebrities", user_one.id)
+        expected = sorted(
+            rating.id
+            for rating in Rating.query.filter(
+                Rating.user_id.in_([user_one.id, user_two.id])
+            )
+        )
+
+        # ratings of celebrities are merged when read, not filled
+        fill_timeline(user_three.id)
+        fill_timeline(user_three.id, user_one.id)
+        self.assertEqual(get_timeline(user_three.id, 20, 60)[1], 1)
+        pagination = get_follow_feed(user_three, 1, 2)
+        self.assertEqual((pagination.total, pagination.pages), (3, 2))
+        self.assertEqual(
+            sorted(
+                [rating.id for rating in pagination.items]
+                + [rating.id for rating in get_follow_feed(user_three, 2, 2).items]
+            ),
+            expected,
+        )
+        # merged ratings are not counted past the cap
+        size = current_app.config["FEED_TIMELINE_SIZE"]
+        current_app.config["FEED_TIMELINE_SIZE"] = 2
+        pagination = get_follow_feed(user_three, 1, 2)
+        current_app.config["FEED_TIMELINE_SIZE"] = size
+        self.assertEqual((pagination.total, pagination.has_next), (2, False))
+        # the pushed ratings of a user who became a celebrity are dropped
+        redis_store.sadd("feed:celebrities", user_two.id)
+        remove_author_from_timelines(user_two.id)
+        # an empty timeline is still filled
+        self.assertEqual(get_timeline(user_three.id, 20, 60), ([], 0))
+        # and pushed again when he is no longer one
+        redis_store.srem("feed:celebrities", user_two.id)
+        push_author_to_timelines(user_two.id)
+        self.assertEqual(get_timeline(user_three.id, 20, 60)[1], 1)
+
+    def test_cursor_paginate(self):
+        movie = Movie.create_one(title="one", subtype=MovieType.MOVIE, year=2006)
+        db.session.add(movie)
+        for i in range(5):
+            user = User.create_one(
+                username="user_%d" % i, email=fake.email(), password="123456"
+            )
+            db.session.add(user)
+            user.collect_movie(movie, i, "comment %d" % i)
+        db.session.commit()
+        columns = [Rating.created_at, Rating.id]
+        expected = [
+            rating.id
+            for rating in movie.ratings.order_by(
+                Rating.created_at.desc(), Rating.id.desc()
+            )
+        ]
+        pages, after = [], None
+        while True:
+            pagination = cursor_paginate(movie.ratings, columns, 2, after=after)
+            pages.append([rating.id for rating in pagination.items])
+            if not pagination.has_next:
+                break
+            after = cursor(pagination.next_cursor)
+        self.assertEqual(pages, [expected[0:2], expected[2:4], expected[4:5]])
+        self.assertTrue(pagination.has_prev)
+        pagination = cursor_paginate(
+            movie.ratings, columns, 2, before=cursor(pagination.prev_cursor)
+        )
+        self.assertEqual([rating.id for rating in pagination.items], expected[2:4])
+        self.assertTrue(pagination.has_prev)
+        self.assertTrue(pagination.has_next)
+
+    def test_paginate_total(self):
+        movie = Movie.create_one(title="one", subtype=MovieType.MOVIE, year=2006)
+        db.session.add(movie)
+        users = []
+        for i in range(6):
+            user = User.create_one(
+                username="user_%d" % i, email=fake.email(), password="123456"
+            )
+            db.session.add(user)
+            users.append(user)
+        for user in users[:5]:
+            user.collect_movie(movie, 8, "comment")
+        db.session.commit()
+        query = Rating.query.filter_by(movie_id=movie.id).order_by(Rating.id)
+        redis_store.delete("count:" + _count_key(query))
+        self.assertEqual(paginate(query, 1, 2, exact=False).total, 4)
+        self.assertEqual(paginate(query, 3, 2, exact=False).total, 5)
+        self.assertEqual(paginate(query, 1, 2).total, 5)
+        users[5].collect_movie(movie, 8, "comment")
+        db.session.commit()
+        # cached
+        self.assertEqual(paginate(query, 2, 2).total, 5)
+        self.assertEqual(paginate(query, 1, 2, total=movie.rating_count).total, 6)
+
+    def test_like_count(self):
+        movie = Movie.create_one(title="one", subtype=MovieType.MOVIE, year=2006)
+        db.session.add(movie)
+        users = []
+        for i in range(3):
+            user = User.create_one(
+                username="user_%d" % i, email=fake.email(), password="123456"
+            )
+            db.session.add(user)
+            users.append(user)
+            user.collect_movie(movie, 8, "comment")
+        db.session.commit()
+        one, two, three = movie.ratings.order_by(Rating.id).all()
+        self.assertTrue(two.like_by(users[0]))
+        self.assertTrue(two.like_by(users[2]))
+        self.assertTrue(three.like_by(users[0]))
+        self.assertFalse(three.like_by(users[0]))
+        db.session.commit()
+        self.assertEqual([one.like_count, two.like_count, three.like_count], [0, 2, 1])
+        self.assertTrue(two.unlike_by(users[2]))
+        db.session.commit()
+        self.assertEqual(two.like_count, 1)
+        self.assertEqual(
+            movie.ratings.order_by(Rating.like_count.desc(), Rating.id.desc()).all(),
+            [three, two, one],
+        )
+        three.like_count = 5
+        db.session.commit()
+        self.assertEqual(Rating.rebuild_like_counts(), 1)
+        db.session.commit()
+        self.assertEqual(three.like_count, 1)
+
+    def test_rank_windows(self):
+        today = datetime.date.today()
+        day_keys = [
+            "rating:" + (today - datetime.timedelta(days=i)).strftime("%y%m%d")
+            for i in range(31)
+        ]
+        redis_store.delete(
+            "rating:rank:week", "rating:rank:month", "rating:rank:day", *day_keys
+        )
+        movies = [
+            Movie.create_one(title=title, subtype=MovieType.MOVIE, year=2006)
+            for title in ("one", "two")
+        ]
+        db.session.add_all(movies)
+        users = []
+        for i in range(2):
+            user = User.create_one(
+                username="user_%d" % i, email=fake.email(), password="123456"
+            )
+            db.session.add(user)
+            users.append(user)
+        db.session.commit()
+        users[0].collect_movie(movies[0], 8, "comment")
+        users[0].collect_movie(movies[1], 8, "comment")
+        users[1].collect_movie(movies[1], 8, "comment")
+        db.session.commit()
+        ranked = [(movies[1].id, 2), (movies[0].id, 1)]
+        self.assertEqual(get_rank_movie_ids("week"), (ranked, 2))
+        # a rating 10 days ago only counts in the month window
+        self.assertTrue(rebuild_rank_windows())
+        self.assertFalse(rebuild_rank_windows())
+        redis_store.zincrby(day_keys[10], 5, str(movies[0].id))
+        self.assertTrue(rebuild_rank_windows(force=True))
+        self.assertEqual(get_rank_movie_ids("week"), (ranked, 2))
+        self.assertEqual(
+            get_rank_movie_ids("month", per_page=1), ([(movies[0].id, 6)], 2)
+        )
+        users[0].delete_rating_on(movies[0])
+        db.session.commit()
+        self.assertEqual(get_rank_movie_ids("week"), ([(movies[1].id, 2)], 1))
+        # rebuilt from table ratings, the fake count of 10 days ago is dropped
+        self.assertEqual(rebuild_rank_data(), 2)
+        self.assertEqual(get_rank_movie_ids("month"), ([(movies[1].id, 2)], 1))
+        # an empty window does not change the version of the leaderboards
+        redis_store.delete("rating:rank:week")
+        version = get_rank_version()
+        self.assertEqual(get_rank_movie_ids("week"), ([], 0))
+        self.assertEqual(get_rank_version(), version)
+
+    def test_load_movies_in_order(self):
+        movies = [
+            Movie.create_one(title=title, subtype=MovieType.MOVIE, year=2006)
+            for title in ("one", "two", "three")
+        ]
+        db.session.add_all(movies)
+        db.session.commit()
+        ids = [movies[2].id, movies[0].id, -1, movies[1].id]
+        db.session.expunge_all()
+        self.assertEqual(
+            [movie.title for movie in load_movies_in_order(ids)],
+            ["three", "one", "two"],
+        )
+        self.assertEqual(load_movies_in_order([]), [])
+
+    def test_search_outbox(self):
+        redis_store.delete("search:outbox:users")
+        u = User.create_one(username="outbox", email=fake.email(), password="123456")
+        db.session.add(u)
+        db.session.commit()
+        user_id = u.id
+        u.username = "outbox_renamed"
+        db.session.commit()
+        # repeated changes of one document are coalesced
+        self.assertEqual(pop_search_outbox("users"), {user_id: "index"})
+        self.assertEqual(pop_search_outbox("users"), {})
+        # fields not indexed are not synced
+        u.last_login_time = datetime.datetime.now()
+        u.signature = u.signature
+        db.session.commit()
+        self.assertEqual(pop_search_outbox("users"), {})
+        # changes flushed before commit are synced as well
+        u.signature = "flushed"
+        db.session.flush()
+        u.last_login_time = datetime.datetime.now()
+        db.session.commit()
+        self.assertEqual(pop_search_outbox("users"), {user_id: "index"})
+        # flushed changes rolled back are not synced
+        u.signature = "rolled back"
+        db.session.flush()
+        db.session.rollback()
+        u.last_login_time = datetime.datetime.now()
+        db.session.commit()
+        self.assertEqual(pop_search_outbox("users"), {})
+        db.session.delete(u)
+        db.session.commit()
+        # a failed change does not replace a newer one
+        requeue_search_outbox("users", {user_id: "index", user_id + 1: "index"})
+        self.assertEqual(
+            pop_search_outbox("users"), {user_id: "delete", user_id + 1: "index"}
+        )
+
+    def test_local_search(self):
+        self.assertEqual(
+            tokenize("肖申克 Redemption"),
+            ["肖", "申", "克", "肖申", "申克", "redemption"],
+        )
+        self.assertEqual(tokenize("肖申克", query=True), ["肖申", "申克"])
+        directory = tempfile.mkdtemp()
+        writer = LocalSearchIndex(directory, "movies")
+        reader = LocalSearchIndex(directory, "movies")
+        writer.write(
+            [
+                ("index", 1, {"title": "肖申克的救赎", "summary": "hope"}),
+                ("index", 2, {"title": "救赎", "summary": None}),
+                ("index", 3, {"title": "The Shawshank Redemption", "summary": "hope"}),
+            ]
+        )
+        weights = {"title": 4, "summary": 1}
+        # the shorter title ranks first
+        self.assertEqual(reader.search("救赎", weights, 1, 10), ([2, 1], 2))
+        self.assertEqual(reader.search("救", weights, 2, 1), ([1], 2))
+        # equal scores are ordered by id
+        self.assertEqual(reader.search("HOPE", weights, 1, 10), ([1, 3], 2))
+        # compacted into a snapshot, replayed by the other instance
+        writer.write([("delete", 2, None)], compact_size=1)
+        self.assertEqual(
+            sorted(os.listdir(directory)), ["movies-1.snapshot", "movies.lock"]
+        )
+        self.assertEqual(reader.search("救赎", weights, 1, 10), ([1], 1))
+        reloaded = LocalSearchIndex(directory, "movies")
+        self.assertEqual(reloaded.search("redemption", weights, 1, 10), ([3], 1))
+
+    def test_search_hydration(self):
+        # the local index is used when elasticsearch is not configured
+        current_app.elasticsearch = None
+        current_app.config["LOCAL_SEARCH_DIR"] = tempfile.mkdtemp()
+        redis_store.delete("search:outbox:movies")
+        cache.clear()
+        movies = [
+            Movie.create_one(title=title, subtype=MovieType.MOVIE, year=2006)
+            for title in ("救赎", "肖申克的救赎", "other")
+        ]
+        db.session.add_all(movies)
+        db.session.commit()
+        sync_search_index()
+        items, total = Movie.search(" 救赎 ", 1, 10)
+        self.assertEqual(items, [movies[0], movies[1]])
+        self.assertEqual(total, 2)
+        # hits are cached, deleted movies are skipped
+        db.session.delete(movies[0])
+        db.session.commit()
+        items, total = Movie.search("救赎", 1, 10)
+        self.assertEqual(items, [movies[1]])
+        self.assertEqual(Movie.search("nothing", 1, 10), ([], 0))
@@ -0,0 +1,110 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from app.utils.similarity_snapshot import (
+    SimilaritySnapshot,
+    remove_old_snapshots,
+    snapshot_path,
+    snapshot_arrays,
+    splice_rows,
+    write_snapshot_arrays,
+)
+
+
+def _write(directory, version, neighbours):
+    return write_snapshot_arrays(directory, version, snapshot_arrays(neighbours))
+
+
+def _to_dict(snapshot):
+    """
+    :return: {movie_id: [(movie_id, similarity), ...]} of every row
+    """
+    movie_ids = snapshot.item_ids.tolist()
+    res = {movie_id: [] for movie_id in movie_ids}
+    for owner, j, w in zip(*snapshot.gather(movie_ids, len(snapshot.weights))):
+        res[movie_ids[owner]].append((int(j), float(w)))
+    return res
+
+
+class SimilaritySnapshotTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_write_and_read(self):
+        neighbours = {
+            3: [(1, 0.75), (2, 0.5)],
+            1: [(3, 0.75)],
+            2: [(3, 0.5), (1, 0.25), (4, 0.125)],
+        }
+        snapshot = SimilaritySnapshot(_write(self.directory, 7, neighbours))
+        self.assertEqual(snapshot.version, 7)
+        self.assertEqual(len(snapshot), 3)
+        self.assertEqual(_to_dict(snapshot), neighbours)
+        self.assertEqual(snapshot.rows([2, 5, 0]).tolist(), [1, -1, -1])
+
+    def test_gather(self):
+        neighbours = {
+            1: [(3, 0.75), (2, 0.5), (4, 0.25)],
+            2: [(1, 0.5)],
+            3: [(1, 0.75), (4, 0.125)],
+        }
+        snapshot = SimilaritySnapshot(_write(self.directory, 1, neighbours))
+        owner, neighbour_ids, weights = snapshot.gather([3, 9, 1], 2)
+        self.assertEqual(owner.tolist(), [0, 0, 2, 2])
+        self.assertEqual(neighbour_ids.tolist(), [1, 4, 3, 2])
+        self.assertEqual(weights.tolist(), [0.75, 0.125, 0.75, 0.5])
+
+    def test_splice_rows(self):
+        neighbours = {
+            1: [(3, 0.75), (2, 0.5)],
+            2: [(1, 0.5)],
+            3: [(1, 0.75), (4, 0.125)],
+            5: [(1, 0.25)],
+        }
+        snapshot = SimilaritySnapshot(_write(self.directory, 1, neighbours))
+        # rows are replaced, dropped and inserted in movie id order
+        rows = {1: [(5, 0.25)], 2: [], 4: [(3, 0.125)], 9: []}
+        spliced = SimilaritySnapshot(
+            write_snapshot_arrays(self.directory, 2, splice_rows(snapshot, rows))
+        )
+        self.assertEqual(
+            _to_dict(spliced),
+            {
+                1: [(5, 0.25)],
+                3: [(1, 0.75), (4, 0.125)],
+                4: [(3, 0.125)],
+                5: [(1, 0.25)],
+            },
+        )
+        empty = SimilaritySnapshot(_write(self.directory, 3, {}))
+        self.assertEqual(
+            _to_dict(
+                SimilaritySnapshot(
+                    write_snapshot_arrays(self.directory, 4, splice_rows(empty, rows))
+                )
+            ),
+            {1: [(5, 0.25)], 4: [(3, 0.125)]},
+        )
+
+    def test_empty(self):
+        snapshot = SimilaritySnapshot(_write(self.directory, 1, {}))
+        self.assertEqual(snapshot.rows([1]).tolist(), [-1])
+        owner, neighbour_ids, weights = snapshot.gather([1], 10)
+        self.assertEqual((len(owner), len(neighbour_ids), len(weights)), (0, 0, 0))
+
+    def test_remove_old_snapshots(self):
+        for version in range(1, 5):
+            _write(self.directory, version, {1: [(2, 1.0)]})
+        remove_old_snapshots(self.directory, keep=2)
+        self.assertEqual(
+            sorted(os.listdir(self.directory)),
+            [
+                os.path.basename(snapshot_path(self.directory, 3)),
+                os.path.basename(snapshot_path(self.directory, 4)),
+            ],
+        )